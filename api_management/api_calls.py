@@ -13,26 +13,42 @@ All files will be created in the sub-directory "data". they will be name accordi
 the function called in SLV API.
 """
 
-from typing import Union, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Union, Tuple, Iterable
 
 import requests
 from webob.multidict import MultiDict
-from datetime import datetime
-from os import path
 # from re import sub
 # from sys import argv
 # from raw_extractions.models import SubDevice
 
-from .file_writing import write_request, read_json_file, write_to_json_file
+from settings import SLV_CLIENT_OPTIONS, HISTORY_COMPRESSION
+from .file_writing import write_request, read_json_file, write_to_json_file, json_file_name
+from .json_stream import iter_json_array
+from .log_values import merge_log_values
+from .slv_client import SLVClient, get_client
+
+
+def check_write_stream(api_method: str, write_file_to: str, stream: bool):
+    """raise ValueError if a file is asked from a streamed call: writing the file would consume the returned body"""
+    if write_file_to and stream:
+        raise ValueError(
+            "wrong input parameters for call_SLV_{} function : write_file_to cannot be used with stream=True \n".format(
+                api_method))
 
 
 def call_SLV_getAllControllers(url: str, authentication: tuple, format: str,
-                               write_file_to: str = "") -> Union[Tuple[requests.request, str], requests.request]:
+                               write_file_to: str = "", client: SLVClient = None,
+                               stream: bool = False,
+                               refresh: bool = False) -> Union[Tuple[requests.request, str], requests.request]:
     """Call SLV with function 'getAllControllers'. Return obtained data in the demanded format
     :param url: the URL of the website
     :param authentication: tuple giving ('identifier','password')
     :param format: write 'json' if you want a json request or 'xml' if you want an XML request
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
+    :param refresh: if True, bypass the response cache and store the fresh answer in it
     :return: the raw request from StreetLight Vision server
     :rtype: requests """
     api_method = 'getAllControllers'  # function which gets called on SLV server
@@ -44,9 +60,11 @@ def call_SLV_getAllControllers(url: str, authentication: tuple, format: str,
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + '...')
-    r = requests.get(url + api_part + api_method, params=param, auth=authentication)  # call the request
-    if write_file_to == "":  # if asked, writes file
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.get(api_part, api_method, param, stream=stream, refresh=refresh)  # call the request
+    if write_file_to:  # if asked, writes file
         file_name = api_method  # the output file name if write_file is true
         write_request(r, param, write_file_to)
         return r, file_name
@@ -54,7 +72,9 @@ def call_SLV_getAllControllers(url: str, authentication: tuple, format: str,
 
 
 def call_SLV_searchGeozones(url: str, authentication: tuple, format: str, name: str, partialMatch: bool,
-                            write_file_to: str = "") -> Union[Tuple[requests.request, str], requests.request]:
+                            write_file_to: str = "", client: SLVClient = None,
+                            stream: bool = False,
+                            refresh: bool = False) -> Union[Tuple[requests.request, str], requests.request]:
     """Call SLV with function 'searchGeozones'. Return obtained data in the demanded format
     :param url: the URL of the website
     :param authentication: tuple giving ('identifier','password')
@@ -62,6 +82,9 @@ def call_SLV_searchGeozones(url: str, authentication: tuple, format: str, name:
     :param name: string name of the geoZone to work on
     :param partialMatch: boolean indicating if you want the name to match partially or fully
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
+    :param refresh: if True, bypass the response cache and store the fresh answer in it
     :return: the raw request from StreetLight Vision server
     :rtype: requests """
     api_method = 'searchGeozones'  # function which gets called on SLV server
@@ -73,8 +96,10 @@ def call_SLV_searchGeozones(url: str, authentication: tuple, format: str, name:
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + '...')
-    r = requests.get(url + api_part + api_method, params=param, auth=authentication)  # call the request
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.get(api_part, api_method, param, stream=stream, refresh=refresh)  # call the request
     if write_file_to:  # if asked, writes file
         file_name = api_method  # the output file name if write_file is true
         write_request(r, param, write_file_to)
@@ -84,7 +109,9 @@ def call_SLV_searchGeozones(url: str, authentication: tuple, format: str, name:
 
 def call_SLV_getGeozoneChildrenGeozones(url: str, authentication: tuple, format: str, geozoneId: int,
                                         computeHierarchyInfos: bool,
-                                        write_file_to: str = "") -> Union[
+                                        write_file_to: str = "", client: SLVClient = None,
+                                        stream: bool = False,
+                                        refresh: bool = False) -> Union[
     Tuple[requests.request, str], requests.request]:
     """Call SLV with function 'searchGeozones'. Return obtained data in the demanded format
     :param url: the URL of the website
@@ -93,6 +120,9 @@ def call_SLV_getGeozoneChildrenGeozones(url: str, authentication: tuple, format:
     :param geozoneId: give the ID of the geoZone of interest
     :param computeHierarchyInfos: make a tree of sub-zones.
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
+    :param refresh: if True, bypass the response cache and store the fresh answer in it
     :return: the raw request from StreetLight Vision server
     :rtype: requests """
     api_method = 'getGeozoneChildrenGeozones'  # function which gets called on SLV server
@@ -104,17 +134,21 @@ def call_SLV_getGeozoneChildrenGeozones(url: str, authentication: tuple, format:
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + '...')
-    r = requests.get(url + api_part + api_method, params=param, auth=authentication)  # call the request
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.get(api_part, api_method, param, stream=stream, refresh=refresh)  # call the request
     if write_file_to:  # if asked, writes file
         file_name = api_method  # the output file name if write_file is true
-        write_request(r, param, file_name)
+        write_request(r, param, write_file_to)
         return r, file_name
     return r
 
 
 def call_SLV_getDeviceValueDescriptors(url: str, authentication: tuple, format: str, controllerStrId: str,
-                                       idOnController: str, write_file_to: str = "") -> Union[
+                                       idOnController: str, write_file_to: str = "", client: SLVClient = None,
+                                       stream: bool = False,
+                                       refresh: bool = False) -> Union[
     Tuple[requests.request, str], requests.request]:
     """Call SLV with function 'searchGeozones'. Return obtained data in the demanded format
     :param url: the URL of the website
@@ -123,6 +157,9 @@ def call_SLV_getDeviceValueDescriptors(url: str, authentication: tuple, format:
     :param controllerStrId: controllerStrId as defined in SLV
     :param idOnController: idOnController as defined in SLV
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
+    :param refresh: if True, bypass the response cache and store the fresh answer in it
     :return: the raw request from StreetLight Vision server
     :rtype: requests """
     api_method = 'getDeviceValueDescriptors'  # function which gets called on SLV server
@@ -134,23 +171,30 @@ def call_SLV_getDeviceValueDescriptors(url: str, authentication: tuple, format:
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + '...')
-    r = requests.get(url + api_part + api_method, params=param, auth=authentication)  # call the request
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.get(api_part, api_method, param, stream=stream, refresh=refresh)  # call the request
     if write_file_to:  # if asked, writes file
         file_name = api_method  # the output file name if write_file is true
-        write_request(r, param, file_name)
+        write_request(r, param, write_file_to)
         return r, file_name
     return r
 
 
 def call_SLV_getControllerDevices(url: str, authentication: tuple, format: str, controllerStrId: Union[str, list],
-                                  write_file_to: str = "") -> Union[Tuple[requests.request, str], requests.request]:
+                                  write_file_to: str = "", client: SLVClient = None,
+                                  stream: bool = False,
+                                  refresh: bool = False) -> Union[Tuple[requests.request, str], requests.request]:
     """Call SLV with function 'getAllControllers'. Return obtained data in the demanded format
     :param url: the URL of the website
     :param authentication: tuple giving ('identifier','password')
     :param format: write 'json' if you want a json request or 'xml' if you want an XML request
     :param controllerStrId: the controllerStrId str matching the right name
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
+    :param refresh: if True, bypass the response cache and store the fresh answer in it
     :return: the raw request from StreetLight Vision server
     :rtype: requests """
     api_method = 'getControllerDevices'  # function which gets called on SLV server
@@ -162,21 +206,24 @@ def call_SLV_getControllerDevices(url: str, authentication: tuple, format: str,
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + ' ' + controllerStrId + '...')
-    r = requests.get(url + api_part + api_method, params=param, auth=authentication)  # call the request
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.get(api_part, api_method, param, stream=stream, refresh=refresh)  # call the request
     if write_file_to:  # if asked, writes file
         if type(controllerStrId) is list:
             file_name = api_method  # the output file name if write_file is true and controllerStrId is a list
         else:
             file_name = api_method + param['controllerStrId']  # the output file name if write_file is true
-        write_request(r, param, file_name)
+        write_request(r, param, write_file_to)
         return r, file_name
     return r
 
 
 def call_SLV_getDevicesLogValues(url: str, authentication: tuple, format: str, deviceId: Union[int, list],
                                  name: Union[str, list], from_date: str, to_date: str,
-                                 write_file_to: str = "") -> Union[Tuple[requests.request, str], requests.request]:
+                                 write_file_to: str = "", client: SLVClient = None,
+                                 stream: bool = False) -> Union[Tuple[requests.request, str], requests.request]:
     """
     Call SLV with function 'getDevicesLogValues'. Return obtained data in the demanded format
     :param url: the URL of the website
@@ -187,6 +234,8 @@ def call_SLV_getDevicesLogValues(url: str, authentication: tuple, format: str, d
     :param from_date: in the following format : dd/mm/yyyy hh:mm:ss
     :param to_date: in the following format : dd/mm/yyyy hh:mm:ss
     :param write_file_to: if you want a file to be written, write its path
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param stream: if True the body is only downloaded when read, e.g. by iter_json_array. Not with write_file_to.
     :return: the request
     """
     api_method = 'getDevicesLogValues'  # function which gets called on SLV server
@@ -200,9 +249,10 @@ def call_SLV_getDevicesLogValues(url: str, authentication: tuple, format: str, d
             format == 'json' or format == 'xml'):  # if format argument does not match expected input raises an error
         raise ValueError(
             "wrong input parameters for APIFinal.call_SLV_getAllControllers function : format must be either 'xml' or 'json' \n")
+    check_write_stream(api_method, write_file_to, stream)
     print('calling ' + api_method + '...')
-    r = requests.post(url + api_part + api_method, data=param,
-                      auth=authentication)  # post the request because there are several sub calls
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    r = client.post(api_part, api_method, param, stream=stream)  # post the request because there are several sub calls
     if write_file_to != "":  # if asked, writes file
         if type(deviceId) is list and type(name) is list:
             file_name = api_method  # the output file name if write_file is true and deviceId is a list
@@ -216,7 +266,7 @@ def call_SLV_getDevicesLogValues(url: str, authentication: tuple, format: str, d
             file_name = api_method + "_" + param['deviceId'] + "_" + param[
                 'name']  # the output file name if write_file is true
         file_name = file_name + "_" + param['from'] + "_" + param['to']
-        write_request(r, param, file_name)
+        write_request(r, param, write_file_to)
         return r, file_name
     return r
 
@@ -247,7 +297,7 @@ def getAllControlers_request_to_data(r: requests.request) -> Tuple[list, list, l
     :return: a tuple of the lists of all controllers, all controllers ID and all geozones id.
     :rtype: tuple
     """
-    output_json = r.json()  # get the data out of the request
+    output_json = iter_json_array(r)  # get the data out of the request, one controller at a time
     AllControllers = []  # initialize list of all controllers name
     ControllersID = []  # initialize list of all controllers ID
     GeoZoneId = []  # initialize list of all geo zones ID
@@ -265,7 +315,7 @@ def getControllerDevices_request_to_data(r: requests.request) -> Tuple[list, lis
     :param r: request from getControllerDevices
     :return: returns a tuple of two list containing the ElectricCounter names and their respective IDs.
     """
-    output_json = r.json()  # get the json out of the request
+    output_json = iter_json_array(r)  # get the json out of the request, one device at a time
     for controller in output_json:
         if controller['categoryStrId'] == 'electricalCounter':  # all_counters_category =
             electric_counter_ID = controller['id']  # find the electriccounter id
@@ -273,22 +323,87 @@ def getControllerDevices_request_to_data(r: requests.request) -> Tuple[list, lis
     return electric_counter_str, electric_counter_ID  # , all_counters_category
 
 
-def historize_log_values(write_file_to: str, values: str):
+def crawl_electric_counters(url: str, authentication: tuple, controllers: list = None, max_workers: int = 8,
+                            client: SLVClient = None) -> Tuple[list, list, dict]:
+    """
+    Call getControllerDevices for many controllers at once, at most max_workers calls in flight, and isolate the
+    electric counter of each controller as soon as its answer arrives.
+    :param url: the URL of the website
+    :param authentication: tuple giving ('identifier','password')
+    :param controllers: list of controllerStrId to crawl. If None, all controllers from getAllControllers are crawled
+    :param max_workers: maximum number of simultaneous calls. Keep it below the client pool size.
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :return: a tuple of the electric counters names, their respective IDs and a dict {controllerStrId: error} of the
+    controllers for which no electric counter could be found
+    """
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    if controllers is None:
+        controllers, ControllersID, GeoZoneId = getAllControlers_request_to_data(
+            call_SLV_getAllControllers(url, authentication, 'json', client=client, stream=True))
+    ElectricCounters = []  # initialize list to save all ElectricCounters
+    ElectricCounterIDs = []  # initialize list to save all electric counters id
+    errors = {}  # errors caught for each controller
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call_SLV_getControllerDevices, url, authentication, 'json', controller,
+                                   client=client, stream=True): controller for controller in controllers}
+        for future in as_completed(futures):  # handle each answer as soon as it arrives
+            controller = futures[future]
+            try:
+                request_controller_devices = future.result()
+                request_controller_devices.raise_for_status()
+                electric_counter_str, electric_counter_ID = getControllerDevices_request_to_data(
+                    request_controller_devices)  # isolate the electric counters
+            except (UnboundLocalError, requests.RequestException, ValueError, KeyError) as error_caught:
+                errors[controller] = error_caught  # no electric counter found, call failed or answer unreadable
+            else:
+                ElectricCounters.append(electric_counter_str)  # add to the saving list
+                ElectricCounterIDs.append(electric_counter_ID)  # add to the saving list
+    return ElectricCounters, ElectricCounterIDs, errors
+
+
+def crawl_controller_devices(url: str, authentication: tuple, controllers: list, max_workers: int = 8,
+                             client: SLVClient = None, refresh: bool = False) -> Tuple[dict, dict]:
+    """
+    Call getControllerDevices for many controllers at once, at most max_workers calls in flight, keeping every device.
+    :param url: the URL of the website
+    :param authentication: tuple giving ('identifier','password')
+    :param controllers: list of controllerStrId to crawl
+    :param max_workers: maximum number of simultaneous calls. Keep it below the client pool size.
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :param refresh: if True, bypass the response cache and store the fresh answers in it
+    :return: a tuple of a dict {controllerStrId: list of its devices} and a dict {controllerStrId: error} of the
+    controllers whose devices could not be read
+    """
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    devices = {}  # devices of each controller
+    errors = {}  # errors caught for each controller
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call_SLV_getControllerDevices, url, authentication, 'json', controller,
+                                   client=client, stream=True, refresh=refresh): controller
+                   for controller in controllers}
+        for future in as_completed(futures):
+            controller = futures[future]
+            try:
+                request_controller_devices = future.result()
+                request_controller_devices.raise_for_status()
+                devices[controller] = list(iter_json_array(request_controller_devices))
+            except (requests.RequestException, ValueError) as error_caught:
+                errors[controller] = error_caught  # call failed or answer unreadable
+    return devices, errors
+
+
+def historize_log_values(write_file_to: str, values: Iterable[dict], compression: str = HISTORY_COMPRESSION):
     """
     hitorize all data for the given log value name on the given file which will end by history instead of its dates
     :param write_file_to: the path where to write the file
-    :param filename:
-    :param file_name_log_values: read the request file
+    :param values: the new log values, e.g. r.json() or iter_json_array(r)
+    :param compression: compression of the file written, see write_to_json_file. Defaults to HISTORY_COMPRESSION.
     """
-    if path.isfile(write_file_to ):
+    if json_file_name(write_file_to):
         historic = read_json_file(write_file_to)
-        historic += values
-        unique = []
-        [unique.append(elem) for elem in historic if elem not in unique]
-        unique.sort(key=lambda event: datetime.strptime(event["eventTime"], "%Y-%m-%d %H:%M:%S"))
-        write_to_json_file(write_file_to, unique)
     else:
-        write_to_json_file(write_file_to, values)
+        historic = []
+    write_to_json_file(write_file_to, merge_log_values(historic, values), compression)
 
 # def update_values_for_device(write_file_to: str, sub_device: SubDevice):
 #     """
@@ -0,0 +1,114 @@
+"""
+Backfill of long getDevicesLogValues ranges.
+
+Instead of one huge call, [from_date, to_date] is split into day, week or month chunks fetched in parallel. Chunks are
+appended to the history store in time order as soon as they and all the chunks before them are available, and a
+failing chunk is retried on its own instead of restarting the whole range.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import sleep
+from typing import Union, List, Tuple
+
+import requests
+
+from settings import SLV_CLIENT_OPTIONS
+from .api_calls import call_SLV_getDevicesLogValues
+from .history_store import HistoryStore
+from .json_stream import iter_json_array
+from .log_values import event_time
+from .slv_client import SLVClient, get_client
+
+CHUNK_LENGTHS = {'day': timedelta(days=1), 'week': timedelta(weeks=1), 'month': None}  # month has no fixed length
+
+
+def split_date_range(from_date: datetime, to_date: datetime, chunk: str) -> List[Tuple[datetime, datetime]]:
+    """
+    Split [from_date, to_date] into consecutive chunks.
+    :param from_date: start of the range
+    :param to_date: end of the range
+    :param chunk: 'day', 'week' or 'month'. Month chunks end on the first day of each month.
+    :return: list of (start, end) tuples, the end of a chunk being the start of the next one
+    """
+    if chunk not in CHUNK_LENGTHS:
+        raise ValueError("wrong input parameters for split_date_range function : chunk must be one of {}\n".format(
+            ', '.join(CHUNK_LENGTHS)))
+    chunks = []
+    start = from_date
+    while start < to_date:
+        if chunk == 'month':
+            end = (start.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=32)).replace(day=1)
+        else:
+            end = start + CHUNK_LENGTHS[chunk]
+        end = min(end, to_date)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def fetch_chunk(url: str, authentication: tuple, deviceId: Union[int, list], name: Union[str, list],
+                start: datetime, end: datetime, retries: int, client: SLVClient) -> list:
+    """
+    Fetch the log values of one chunk, retrying it on its own when it fails.
+    :return: the events of the chunk sorted by eventTime
+    """
+    attempt = 0
+    while True:
+        try:
+            r = call_SLV_getDevicesLogValues(url, authentication, 'json', deviceId, name,
+                                             start.strftime("%d/%m/%Y %H:%M:%S"), end.strftime("%d/%m/%Y %H:%M:%S"),
+                                             client=client, stream=True)
+            r.raise_for_status()
+            return sorted(iter_json_array(r), key=event_time)
+        except (requests.RequestException, ValueError):
+            if attempt >= retries:
+                raise
+        sleep(2 ** attempt)
+        attempt += 1
+
+
+def backfill_log_values(url: str, authentication: tuple, store: HistoryStore, deviceId: Union[int, list],
+                        name: Union[str, list], from_date: datetime, to_date: datetime, chunk: str = 'week',
+                        max_workers: int = 4, retries: int = 2,
+                        client: SLVClient = None) -> Tuple[int, List[Tuple[datetime, datetime]]]:
+    """
+    Fetch the log values of [from_date, to_date] chunk by chunk, at most max_workers chunks in flight, and append them
+    to store in time order.
+    If a chunk still fails after its retries, nothing after it is appended, so that the watermarks of the store never
+    jump over a hole: the returned chunks can be backfilled again later.
+    :param url: the URL of the website
+    :param authentication: tuple giving ('identifier','password')
+    :param store: the history store to fill
+    :param deviceId: device ID or list of device IDs, as for call_SLV_getDevicesLogValues
+    :param name: log value name or list of names, as for call_SLV_getDevicesLogValues
+    :param from_date: start of the range
+    :param to_date: end of the range
+    :param chunk: 'day', 'week' or 'month'
+    :param max_workers: maximum number of chunks fetched at once
+    :param retries: number of times a failing chunk is fetched again
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :return: the number of events added and the list of (start, end) chunks which were not appended
+    """
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    chunks = split_date_range(from_date, to_date, chunk)
+    added = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()  # futures of the chunks in flight, in time order
+        next_chunk = 0
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < 2 * max_workers:  # keep workers busy, bound memory
+                start, end = chunks[next_chunk]
+                pending.append(executor.submit(fetch_chunk, url, authentication, deviceId, name, start, end,
+                                               retries, client))
+                next_chunk += 1
+            future = pending.popleft()
+            try:
+                events = future.result()
+            except (requests.RequestException, ValueError):
+                for other in pending:
+                    other.cancel()
+                return added, chunks[next_chunk - len(pending) - 1:]
+            added += store.append(events)
+    return added, []
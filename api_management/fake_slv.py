@@ -0,0 +1,242 @@
+"""
+Local stand-in for the SLV server, serving a synthetic fleet, for benchmarks and manual tests.
+
+It answers getAllControllers, getControllerDevices, searchGeozones, getGeozoneChildrenGeozones and
+getDevicesLogValues in json, whatever the path before the method name, so SLV_URL can simply point at it. Log values
+are computed from their time when asked, so a fleet of any size and history length costs no memory, and large answers
+are sent with chunked transfer encoding as they are generated. Latency and 503 errors can be injected.
+
+usage: python -m api_management.fake_slv [--controllers 100] [--history-days 30] [--latency 0.05] [--port 8000]
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import sleep
+from typing import Dict, Iterable, Iterator, List
+from urllib.parse import parse_qs, urlsplit
+
+ROOT_GEOZONE_ID = 1
+FIRST_CONTROLLER_ID = 10000
+FIRST_DEVICE_ID = 60000
+COUNTER_NAMES = ('TotalKWHPositive', 'DigitalOutput1')  # log values of the electric counters
+
+
+class FakeFleet:
+    """Synthetic SLV fleet: a geozone tree, controllers in its leaves, and devices with their log values"""
+
+    def __init__(self, controllers: int = 10, history_days: int = 30, sample_minutes: int = 10,
+                 geozone_fanout: int = 4, end: datetime = None):
+        """
+        :param controllers: number of controllers. Each one has an electric counter and a lamp output device.
+        :param history_days: days of log values before end
+        :param sample_minutes: minutes between two log values
+        :param geozone_fanout: children of each geozone, the tree being as deep as needed to hold the controllers
+        :param end: time of the last log values, defaults to the start of the current hour
+        """
+        self.end = end or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.start = self.end - timedelta(days=history_days)
+        self.sample = timedelta(minutes=sample_minutes)
+        self.geozones = [{'id': ROOT_GEOZONE_ID, 'name': 'root', 'parentId': None}]
+        leaves = [ROOT_GEOZONE_ID]
+        while len(leaves) * geozone_fanout <= controllers:
+            children = []
+            for parent_id in leaves:
+                for i in range(geozone_fanout):
+                    geozone_id = len(self.geozones) + 1
+                    self.geozones.append({'id': geozone_id, 'name': 'zone {}'.format(geozone_id),
+                                          'parentId': parent_id})
+                    children.append(geozone_id)
+            leaves = children
+        self.controllers = [{'controllerStrId': 'CBC_FK_{:04d}'.format(i), 'id': FIRST_CONTROLLER_ID + i,
+                             'name': 'Fake controller {}'.format(i), 'geoZoneId': leaves[i % len(leaves)]}
+                            for i in range(controllers)]
+        self.devices = {controller['controllerStrId']: [
+            {'id': FIRST_DEVICE_ID + 2 * i, 'controllerStrId': controller['controllerStrId'],
+             'categoryStrId': 'electricalCounter', 'name': 'counter {}'.format(i)},
+            {'id': FIRST_DEVICE_ID + 2 * i + 1, 'controllerStrId': controller['controllerStrId'],
+             'categoryStrId': 'lampOutput', 'name': 'output {}'.format(i)}]
+            for i, controller in enumerate(self.controllers)}
+
+    @property
+    def counter_ids(self) -> List[int]:
+        """device IDs of the electric counters"""
+        return [devices[0]['id'] for devices in self.devices.values()]
+
+    def children(self, geozone_id: int) -> List[dict]:
+        return [geozone for geozone in self.geozones if geozone['parentId'] == geozone_id]
+
+    def log_values(self, device_id: int, name: str, from_date: datetime, to_date: datetime) -> Iterator[dict]:
+        """
+        Log values of a device between from_date and to_date. TotalKWHPositive grows as with a constant 0.5 kW load,
+        DigitalOutput1 is on from 18:00 to 07:00. Other names have no values.
+        """
+        if name not in COUNTER_NAMES:
+            return
+        kwh_per_sample = 0.5 * self.sample.total_seconds() / 3600
+        time = max(from_date, self.start)
+        time += (self.start - time) % self.sample  # first sample time not before from_date
+        while time <= min(to_date, self.end):
+            if name == 'TotalKWHPositive':
+                value = round(device_id % 100 + (time - self.start) // self.sample * kwh_per_sample, 3)
+            else:
+                value = 'true' if time.hour >= 18 or time.hour < 7 else 'false'
+            yield {'deviceId': device_id, 'name': name, 'eventTime': time.strftime("%Y-%m-%d %H:%M:%S"),
+                   'value': value}
+            time += self.sample
+
+
+def parse_slv_date(value: str) -> datetime:
+    """datetime of an SLV dd/mm/yyyy or dd/mm/yyyy hh:mm:ss parameter"""
+    return datetime.strptime(value, "%d/%m/%Y %H:%M:%S" if ' ' in value else "%d/%m/%Y")
+
+
+class FakeSLVHandler(BaseHTTPRequestHandler):
+    """answers the SLV API methods of the fleet of its server"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.answer(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        self.answer(urlsplit(self.path).path, parse_qs(body))
+
+    def answer(self, path: str, params: Dict[str, list]):
+        try:
+            self.answer_method(path, params)
+        except (BrokenPipeError, ConnectionResetError):  # the client stopped reading, e.g. a retried 503
+            self.close_connection = True
+
+    def answer_method(self, path: str, params: Dict[str, list]):
+        server = self.server
+        if server.latency:
+            sleep(server.latency)
+        if server.should_fail():
+            self.send_json_array([], status=503)
+            return
+        fleet = server.fleet
+        api_method = path.rstrip('/').rsplit('/', 1)[-1]
+        if api_method == 'getAllControllers':
+            self.send_json_array({'controllerDevice': controller} for controller in fleet.controllers)
+        elif api_method == 'getControllerDevices':
+            self.send_json_array(device for controller in params.get('controllerStrId', [])
+                                 for device in fleet.devices.get(controller, []))
+        elif api_method == 'searchGeozones':
+            name = params.get('name', [''])[0]
+            partial = params.get('partialMatch', ['False'])[0].lower() == 'true'
+            self.send_json_array(geozone for geozone in fleet.geozones
+                                 if geozone['name'] == name or (partial and name in geozone['name']))
+        elif api_method == 'getGeozoneChildrenGeozones':
+            self.send_json_array(fleet.children(int(params['geozoneId'][0])))
+        elif api_method == 'getDevicesLogValues':
+            from_date, to_date = parse_slv_date(params['from'][0]), parse_slv_date(params['to'][0])
+            device_ids = [int(device_id) for device_id in params.get('deviceId', [])]
+            names = params.get('name', [])
+            if len(names) == 1:  # one name asked for every device
+                names = names * len(device_ids)
+            self.send_json_array(event for device_id, name in zip(device_ids, names)
+                                 for event in fleet.log_values(device_id, name, from_date, to_date))
+        else:
+            self.send_json_array([], status=404)
+
+    def send_json_array(self, items: Iterable, status: int = 200):
+        """send items as a json array, in chunks of about 64KB"""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        parts = ['[']
+        size = 1
+        for i, item in enumerate(items):
+            part = (',' if i else '') + json.dumps(item)
+            parts.append(part)
+            size += len(part)
+            if size >= 64 * 1024:
+                self.write_chunk(''.join(parts))
+                parts, size = [], 0
+        parts.append(']')
+        self.write_chunk(''.join(parts))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+
+    def log_message(self, format, *args):
+        pass  # one line per request would flood benchmarks
+
+
+class FakeSLVServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of a FakeFleet, run in a background thread"""
+    daemon_threads = True
+
+    def __init__(self, fleet: FakeFleet, latency: float = 0., error_rate: float = 0., port: int = 0, seed: int = 0):
+        """
+        :param fleet: the fleet served
+        :param latency: seconds waited before each answer
+        :param error_rate: share of requests answered with a 503
+        :param port: port to listen to on localhost, 0 for any free port
+        :param seed: seed of the error draws, for repeatable runs
+        """
+        super().__init__(('127.0.0.1', port), FakeSLVHandler)
+        self.fleet = fleet
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """the URL to use as SLV_URL"""
+        return 'http://127.0.0.1:{}/reports'.format(self.server_address[1])
+
+    def handle_error(self, request, client_address):
+        """ignore clients which went away, e.g. on a timeout or a retried 503, instead of printing a traceback"""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def should_fail(self) -> bool:
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def start(self) -> str:
+        """serve in a daemon thread and return the URL"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'FakeSLVServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--controllers', type=int, default=100)
+    parser.add_argument('--history-days', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0., help='seconds waited before each answer')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of requests answered with a 503')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    server = FakeSLVServer(FakeFleet(args.controllers, args.history_days), args.latency, args.error_rate, args.port)
+    print('fake SLV serving {} controllers at {}'.format(args.controllers, server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,85 @@
+import gzip
 import json
+import lzma
+import tempfile
 import xml.etree.ElementTree as ET
-from os import path, makedirs
+from os import path, makedirs, remove, replace
 from re import sub
-from typing import Union
+from typing import IO, Iterator, Optional, Union
 
 import requests
 from webob.multidict import MultiDict
 
+CHUNK_SIZE = 64 * 1024  # bytes of a response written at once by write_request
+COMPRESSIONS = {'gzip': ('.gz', gzip.open, b'\x1f\x8b'),
+                'lzma': ('.xz', lzma.open, b'\xfd7zXZ\x00')}  # compression: (file extension, open, magic bytes)
+
+
+def detect_compression(full_name: str) -> Optional[str]:
+    """the compression of a file, from its first bytes, None if it is not compressed"""
+    with open(full_name, 'rb') as fp:
+        start = fp.read(6)
+    for compression, (extension, open_compressed, magic) in COMPRESSIONS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def open_file(full_name: str, mode: str = 'rb', compression: str = None) -> IO:
+    """
+    Open a file which may be compressed with gzip or lzma.
+    :param full_name: path and name of the file
+    :param mode: 'rb', 'wb', 'rt' or 'wt'
+    :param compression: 'gzip', 'lzma' or None. When reading it is detected from the file, when writing it defaults to
+    the one given by the extension of full_name.
+    """
+    if 'r' in mode:
+        compression = detect_compression(full_name)
+    elif compression is None:
+        compression = next((name for name, (extension, open_compressed, magic) in COMPRESSIONS.items()
+                            if full_name.endswith(extension)), None)
+    if compression is None:
+        return open(full_name, mode)
+    return COMPRESSIONS[compression][1](full_name, mode)
+
+
+def json_file_name(file_path: str) -> Optional[str]:
+    """the json file of file_path: file_path + '.json', compressed or not, None if there is none"""
+    for extension in [''] + [extension for extension, open_compressed, magic in COMPRESSIONS.values()]:
+        if path.isfile(file_path + '.json' + extension):
+            return file_path + '.json' + extension
+    return None
+
 
 def read_json_file(file_path: str):
-    """write a json file
-    :param file_path: data_path where to write as string. The data_path must exist, it must end by backslashes
-    :param file_name: name of file as string
-    :param data: the data to be written
+    """read a json file, compressed or not
+    :param file_path: path and name of the file without its '.json' extension and its compression extension if any
+    :return: the data read
     """
-    full_name = file_path + '.json'  # path and name of file to be read
-    return json.load(open(full_name))  # to print the json file in a clean way with an indent of 4
+    full_name = json_file_name(file_path)  # path and name of file to be read
+    if full_name is None:
+        raise FileNotFoundError("no json file for {}\n".format(file_path))
+    with open_file(full_name, 'rt') as fp:
+        return json.load(fp)
 
 
-def write_to_json_file(file_path: str, data: str):
+def write_to_json_file(file_path: str, data: str, compression: str = None):
     """write a json file
     :param file_path: data_path where to write as string. The data_path must exist, it must end by backslashes
     :param file_name: name of file as string
     :param data: the data to be written
+    :param compression: 'gzip' or 'lzma' to write file_path + '.json.gz' or '.json.xz' compactly, None to write
+    file_path + '.json' indented. The other versions of the file are removed.
     """
-    full_name = file_path + '.json'
-    with open(full_name, 'w') as fp:
-        json.dump(data, fp, indent=4)  # to print the json file in a clean way with an indent of 4
+    full_name = file_path + '.json' + (COMPRESSIONS[compression][0] if compression else '')
+    with open_file(full_name, 'wt', compression) as fp:
+        if compression:
+            json.dump(data, fp, separators=(',', ':'))
+        else:
+            json.dump(data, fp, indent=4)  # to print the json file in a clean way with an indent of 4
+    for extension in [''] + [extension for extension, open_compressed, magic in COMPRESSIONS.values()]:
+        if file_path + '.json' + extension != full_name and path.isfile(file_path + '.json' + extension):
+            remove(file_path + '.json' + extension)
 
 
 def write_to_xml_file(file_path: str, data: str):
@@ -38,18 +91,60 @@ def write_to_xml_file(file_path: str, data: str):
     tree.write(file_path + ".xml")
 
 
-def write_request(request: requests.Response, params: Union[dict, MultiDict], path_to_write: str):
+def iter_xml_file(file_path: str, tag: str) -> Iterator[ET.Element]:
+    """
+    Yield the elements named tag of a XML file, e.g. one written by write_request, parsing it as it is read so that
+    only the current element is in memory.
+    :param file_path: path of the file without its extension
+    :param tag: name of the elements wanted, with its namespace in braces if it has one
+    :raises ET.ParseError: if the file is not well-formed XML
+    """
+    for event, element in ET.iterparse(file_path + ".xml"):
+        if element.tag == tag:
+            yield element
+            element.clear()  # the yielded element is done with
+
+
+def write_response_file(request: requests.Response, full_name: str):
+    """
+    Write the body of a response to a file as it is received, CHUNK_SIZE bytes at a time. It goes to a temporary
+    file renamed to full_name once complete, so full_name never holds a partial answer.
+    :param request: the response. If it was obtained with stream=True its body is consumed.
+    :param full_name: path and name of the file
+    """
+    file_descriptor, temp_name = tempfile.mkstemp(dir=path.dirname(full_name) or '.',
+                                                  prefix='.' + path.basename(full_name), suffix='.tmp')
+    try:
+        with open(file_descriptor, 'wb') as fp:
+            for chunk in request.iter_content(CHUNK_SIZE):
+                fp.write(chunk)
+        replace(temp_name, full_name)
+    except BaseException:
+        remove(temp_name)
+        raise
+
+
+def write_request(request: requests.Response, params: Union[dict, MultiDict], path_to_write: str,
+                  pretty: bool = False):
     """
     from a request, using its parameters (in the SLV format), a file name and a path_for_data, writes the output document in the
     appropriate format.
+    The body is written as received, without being parsed: it is checked when the file is read, with read_json_file or
+    iter_xml_file. If the request was obtained with stream=True its body is consumed by the writing, so the request
+    cannot be read afterwards: call_SLV_* functions do not accept write_file_to with stream=True.
     :param request: input request from which we want to write the file
     :param params: the parameters of the request
     :param file_name: name of the file to be created
     :param path_to_write: where to write the file
+    :param pretty: if True, parse the body and write it back indented instead, which holds it whole in memory
     """
     if not path.isdir(path_to_write):  # if the data_path does not exist
         makedirs(path_to_write)  # create it
-    if params['ser'] == 'json':  # if it's a json request write the json file
+    if params['ser'] not in ('json', 'xml'):
+        return
+    if not pretty:
+        write_response_file(request, path_to_write + '.' + params['ser'])
+    elif params['ser'] == 'json':  # if it's a json request write the json file
         write_to_json_file(path_to_write, request.json())
     elif params['ser'] == 'xml':  # if it's an xml request write an xml file
         write_to_xml_file(path_to_write, request.text)
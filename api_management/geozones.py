@@ -0,0 +1,158 @@
+"""
+Crawler and in-memory index of the SLV geozone tree.
+
+The tree is walked breadth-first from a root geozone: the getGeozoneChildrenGeozones calls of a whole level are sent
+at once, the next level being the children they return. The crawled geozones can be saved to and loaded from a json
+file.
+
+GeozoneTree indexes the tree with an Euler tour: each geozone gets its rank in a depth-first order, and its subtree is
+the range of ranks [rank, rank + size of its subtree). Controllers are kept sorted by the rank of their geozone, so the
+controllers under a geozone are found with two bisections, and per geozone rollups are a single pass over the tree.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+import requests
+
+from settings import SLV_CLIENT_OPTIONS
+from .api_calls import call_SLV_getGeozoneChildrenGeozones
+from .file_writing import read_json_file, write_to_json_file
+from .json_stream import iter_json_array
+from .slv_client import SLVClient, get_client
+
+
+class GeozoneTree:
+    """Parent/children maps of the geozones, with Euler tour ranks for subtree queries"""
+
+    def __init__(self, geozones: Iterable[dict]):
+        """
+        :param geozones: dicts with the 'id', 'name' and 'parentId' of each geozone. The root has no parentId.
+        """
+        self.geozones = {geozone['id']: geozone for geozone in geozones}
+        self.parent = {geozone_id: geozone.get('parentId') for geozone_id, geozone in self.geozones.items()}
+        self.children = defaultdict(list)
+        for geozone_id, parent_id in self.parent.items():
+            if parent_id in self.geozones:
+                self.children[parent_id].append(geozone_id)
+        self.roots = sorted(geozone_id for geozone_id, parent_id in self.parent.items()
+                            if parent_id not in self.geozones)
+        self.order = []  # geozone ids in depth-first order
+        self.rank = {}  # geozone id -> its index in order
+        self.end = {}  # geozone id -> index in order after its subtree
+        for root in self.roots:
+            self._euler_tour(root)
+        self.controllers = []  # (rank of the geozone, controller) sorted
+        self.controller_ranks = []  # rank of the geozone of each controller, for bisections
+
+    def _euler_tour(self, root: int):
+        """rank the subtree of root depth first, without recursion so that deep trees are fine"""
+        stack = [(root, False)]
+        while stack:
+            geozone_id, visited = stack.pop()
+            if visited:
+                self.end[geozone_id] = len(self.order)
+                continue
+            self.rank[geozone_id] = len(self.order)
+            self.order.append(geozone_id)
+            stack.append((geozone_id, True))
+            stack.extend((child, False) for child in sorted(self.children[geozone_id], reverse=True))
+
+    def subtree(self, geozone_id: int) -> List[int]:
+        """the ids of geozone_id and of all geozones under it"""
+        return self.order[self.rank[geozone_id]:self.end[geozone_id]]
+
+    def is_under(self, geozone_id: int, ancestor_id: int) -> bool:
+        """True if geozone_id is ancestor_id or one of its descendants"""
+        return self.rank[ancestor_id] <= self.rank[geozone_id] < self.end[ancestor_id]
+
+    def path(self, geozone_id: int) -> List[int]:
+        """the ids of the geozones from the root down to geozone_id"""
+        path = [geozone_id]
+        while self.parent.get(path[-1]) in self.geozones:
+            path.append(self.parent[path[-1]])
+        return path[::-1]
+
+    def add_controllers(self, controllers: Iterable[Tuple[str, int]]):
+        """
+        :param controllers: (controllerStrId, geoZoneId) pairs, e.g. from getAllControlers_request_to_data. Controllers
+        of geozones outside the tree are ignored.
+        """
+        self.controllers = sorted(self.controllers + [(self.rank[geozone_id], controller)
+                                                      for controller, geozone_id in controllers
+                                                      if geozone_id in self.rank])
+        self.controller_ranks = [rank for rank, controller in self.controllers]
+
+    def controllers_under(self, geozone_id: int) -> List[str]:
+        """the controllers of geozone_id and of all geozones under it"""
+        first = bisect_left(self.controller_ranks, self.rank[geozone_id])
+        last = bisect_left(self.controller_ranks, self.end[geozone_id])
+        return [controller for rank, controller in self.controllers[first:last]]
+
+    def rollup(self, values: Dict[int, float]) -> Dict[int, float]:
+        """
+        :param values: {geozone id: value} of the geozones themselves, e.g. the energy of their own controllers
+        :return: {geozone id: value} summed over the subtree of each geozone
+        """
+        totals = {geozone_id: values.get(geozone_id, 0) for geozone_id in self.order}
+        for geozone_id in reversed(self.order):  # children come after their parent in order
+            parent_id = self.parent[geozone_id]
+            if parent_id in totals:
+                totals[parent_id] += totals[geozone_id]
+        return totals
+
+    def save(self, file_path: str):
+        """write the geozones to file_path + '.json'"""
+        write_to_json_file(file_path, list(self.geozones.values()))
+
+    @classmethod
+    def load(cls, file_path: str) -> 'GeozoneTree':
+        """read the geozones written by save"""
+        return cls(read_json_file(file_path))
+
+
+def crawl_geozones(url: str, authentication: tuple, root_id: int, max_workers: int = 8,
+                   client: SLVClient = None) -> Tuple[GeozoneTree, dict]:
+    """
+    Walk the geozone tree under root_id breadth-first, the children of a whole level being asked at once.
+    :param url: the URL of the website
+    :param authentication: tuple giving ('identifier','password')
+    :param root_id: ID of the geozone to start from
+    :param max_workers: maximum number of simultaneous calls. Keep it below the client pool size.
+    :param client: SLVClient to use, defaults to the shared client for url and authentication
+    :return: the tree of the geozones found and a dict {geozoneId: error} of the geozones whose children could not be
+    read, their subtree being missing from the tree
+    """
+    client = client or get_client(url, authentication, **SLV_CLIENT_OPTIONS)
+    geozones = {root_id: {'id': root_id, 'name': None, 'parentId': None}}
+    errors = {}
+    level = [root_id]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while level:
+            futures = {geozone_id: executor.submit(geozone_children, url, authentication, geozone_id, client)
+                       for geozone_id in level}
+            level = []
+            for geozone_id, future in futures.items():
+                try:
+                    children = future.result()
+                except (requests.RequestException, ValueError, KeyError) as error_caught:
+                    errors[geozone_id] = error_caught
+                    continue
+                for child in children:
+                    if child['id'] not in geozones:  # a geozone is only crawled once, even if SLV loops
+                        geozones[child['id']] = child
+                        level.append(child['id'])
+    return GeozoneTree(geozones.values()), errors
+
+
+def geozone_children(url: str, authentication: tuple, geozone_id: int, client: SLVClient) -> List[dict]:
+    """
+    :return: the 'id', 'name' and 'parentId' of the children of geozone_id
+    """
+    r = call_SLV_getGeozoneChildrenGeozones(url, authentication, 'json', geozone_id, False, client=client,
+                                            stream=True)
+    r.raise_for_status()
+    return [{'id': child['id'], 'name': child.get('name'), 'parentId': child.get('parentId', geozone_id)}
+            for child in iter_json_array(r)]
@@ -0,0 +1,401 @@
+"""
+Append-only store for the history of SLV log values of one device.
+
+Events are appended to JSON Lines segment files, one segment per month of eventTime, next to a small manifest giving
+the last eventTime stored, the watermark (last eventTime) of each log value name and, for each segment, its file, first
+and last eventTime, event count and committed size. Adding new data only writes the new events: a segment is only
+rewritten when events not after the watermark of their name arrive for its month. A range read only opens the segments
+overlapping the range.
+
+Crash safety: the manifest is replaced atomically and is the only reference to committed data. Bytes appended to a
+segment after its committed size, and files the manifest does not reference, are dropped when a writer starts.
+Concurrency: a writer holds an exclusive lock on the lock file of the store, so writers of several processes or threads
+run one after the other, each starting from the manifest committed by the previous one. Recovery only runs under the
+lock. Readers take no lock: they only see committed data, e.g. a web request while an ingestion is running.
+
+Segments of the months before the last one stored can be compressed, by compress_closed_segments or, for a store
+given a compression, each time events are committed. A compressed segment is never appended to: events for its month
+are merged into a new compressed file.
+"""
+
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .file_writing import COMPRESSIONS, open_file
+from .log_values import event_key, event_time, merge_log_values
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = 'lock'
+SEGMENT_EXTENSION = '.jsonl'
+
+
+def atomic_write_json(file_path: str, data):
+    """write data as json to a temporary file, then rename it to file_path so readers never see a partial file"""
+    temporary_path = file_path + '.tmp'
+    with open(temporary_path, 'w') as fp:
+        json.dump(data, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temporary_path, file_path)
+
+
+def lock_file(file_path: str):
+    """open file_path and wait for an exclusive lock on it, released when the returned file is closed"""
+    fp = open(file_path, 'a+b')
+    try:
+        if fcntl:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)  # gives up after 10 seconds, so try again
+                    break
+                except OSError:
+                    continue
+    except BaseException:
+        fp.close()
+        raise
+    return fp
+
+
+def encode_event(event: dict) -> bytes:
+    """one JSON Lines line holding the event"""
+    return (json.dumps(event) + '\n').encode()
+
+
+class HistoryStore:
+    """History of log values stored in monthly JSON Lines segments under directory"""
+
+    def __init__(self, directory: str, read_only: bool = False, compression: str = None):
+        """
+        :param directory: the directory holding the manifest and segments. It is created if needed, unless read only.
+        :param read_only: if True, only read the committed data, a missing directory being an empty store
+        :param compression: 'gzip' or 'lzma' to compress the segments of past months when a writer commits
+        """
+        self.directory = directory
+        self.read_only = read_only
+        self.compression = compression
+        self._lock_fp = None
+        self._obsolete_files = []
+        if not read_only and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._open()
+
+    @property
+    def last_event_time(self) -> str:
+        """eventTime of the most recent event stored, None if the store is empty"""
+        return self.manifest['last_event_time']
+
+    def watermark(self, name: str) -> Optional[str]:
+        """eventTime of the most recent event stored for the log value name, None if there is none"""
+        return self.manifest['watermarks'].get(name)
+
+    def fetch_from(self, names: Iterable[str], overlap: timedelta) -> Optional[datetime]:
+        """
+        Date from which SLV must be asked for new values of all names: the oldest of their watermarks minus overlap.
+        :param names: the log value names to update
+        :param overlap: how far before the watermark to ask again, to catch values stored late by SLV
+        :return: the date, None if one of the names has no watermark and needs a full backfill
+        """
+        watermarks = [self.watermark(name) for name in names]
+        if not watermarks or None in watermarks:
+            return None
+        return datetime.strptime(min(watermarks), "%Y-%m-%d %H:%M:%S") - overlap
+
+    def version(self, start: str = None, end: str = None) -> str:
+        """
+        Identifies the committed content of the range: it changes whenever events are appended or merged into it,
+        but not when events after end are appended. Merged segments get a new file, and an event appended to the
+        range moves the watermark of its name to a time not after end.
+        :param start: first eventTime of the range as "%Y-%m-%d %H:%M:%S", None to start from the beginning
+        :param end: last eventTime of the range as "%Y-%m-%d %H:%M:%S", None to go up to the end
+        :return: the file of each segment overlapping the range and the watermarks capped at end, as a string
+        """
+        segments = self.manifest['segments']
+        files = [segments[month]['file'] for month in sorted(segments)
+                 if (start is None or segments[month]['last'] >= start)
+                 and (end is None or segments[month]['first'] <= end)]
+        watermarks = sorted((name, watermark if end is None else min(watermark, end))
+                            for name, watermark in self.manifest['watermarks'].items())
+        return json.dumps([files, watermarks])
+
+    def append(self, values: Iterable[dict]) -> int:
+        """
+        Add log values to the history. Events more recent than the watermark of their name are appended to their
+        segment, older ones are merged into their segment without duplicates. values is only read once, so it can
+        be a generator: only late events are kept in memory.
+        :param values: log values as returned by getDevicesLogValues, in any order
+        :return: the number of events appended or merged
+        """
+        with self.writer() as writer:
+            for event in values:
+                writer.add(event)
+        return writer.added
+
+    def writer(self) -> 'HistoryWriter':
+        """
+        a writer adding events one at a time, committed all at once when it is closed. It waits for the writers
+        already running and holds the lock of the store until it is closed.
+        """
+        if self.read_only:
+            raise ValueError("the history store in {} is opened read only\n".format(self.directory))
+        return HistoryWriter(self)
+
+    def read_range(self, start: str = None, end: str = None) -> Iterator[dict]:
+        """
+        Read the events with start <= eventTime <= end, sorted by eventTime. Only the segments overlapping the range
+        are opened.
+        :param start: first eventTime wanted as "%Y-%m-%d %H:%M:%S", None to start from the beginning
+        :param end: last eventTime wanted as "%Y-%m-%d %H:%M:%S", None to read up to the end
+        :return: generator of the events
+        """
+        for month in sorted(self.manifest['segments']):
+            segment = self.manifest['segments'][month]
+            if (start is not None and segment['last'] < start) or (end is not None and segment['first'] > end):
+                continue
+            for event in sorted(self._read_segment(month), key=event_time):
+                time = event['eventTime']
+                if (start is None or time >= start) and (end is None or time <= end):
+                    yield event
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.read_range()
+
+    def compress_closed_segments(self, compression: str = 'gzip') -> int:
+        """
+        Compress the segments of the months before the month of the last event stored, which are no longer appended
+        to in the normal course of updates.
+        :param compression: 'gzip' or 'lzma'
+        :return: the number of segments compressed
+        """
+        if self.read_only:
+            raise ValueError("the history store in {} is opened read only\n".format(self.directory))
+        self._lock()
+        try:
+            compressed = self._compress_closed_segments(compression)
+            if compressed:
+                self._save_manifest()
+        finally:
+            self._unlock()
+        return compressed
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _read_segment(self, month: str) -> Iterator[dict]:
+        """read the committed events of a segment, in file order"""
+        segment = self.manifest['segments'][month]
+        with open_file(self._path(segment['file'])) as fp:
+            data = fp.read() if 'compression' in segment else fp.read(segment['size'])  # compressed: all committed
+        for line in data.splitlines():
+            yield json.loads(line)
+
+    def _compress_closed_segments(self, compression: str) -> int:
+        """compress the segments before the month of the last event, the manifest being left to save"""
+        last_month = (self.last_event_time or '')[:7]
+        months = [month for month, segment in self.manifest['segments'].items()
+                  if month < last_month and 'compression' not in segment]
+        for month in months:
+            self._merge_segment(month, [], compression)
+        return len(months)
+
+    def _new_events(self, month: str, events: list) -> list:
+        """the events which are not stored in the segment of month yet, read without rewriting it"""
+        if month not in self.manifest['segments']:
+            return events
+        stored = {event_key(event) for event in self._read_segment(month)}
+        return [event for event in events if event_key(event) not in stored]
+
+    def _merge_segment(self, month: str, events: list, compression: str = None) -> int:
+        """
+        Rewrite a segment with events merged in, under a new file name so the previous file stays valid until the
+        manifest is saved.
+        :param compression: 'gzip' or 'lzma' to compress the new file. A compressed segment stays compressed.
+        :return: the number of events which were not already stored
+        """
+        segments = self.manifest['segments']
+        if month in segments:
+            previous_file = segments[month]['file']
+            merged = merge_log_values(list(self._read_segment(month)), events)
+            generation = segments[month].get('generation', 0) + 1
+            compression = compression or segments[month].get('compression')
+        else:
+            previous_file = None
+            merged = merge_log_values([], events)
+            generation = 0
+        added = len(merged) - (segments[month]['count'] if previous_file else 0)
+        file_name = '{}.{}{}{}'.format(month, generation, SEGMENT_EXTENSION,
+                                       COMPRESSIONS[compression][0] if compression else '')
+        temporary_path = self._path(file_name + '.tmp')
+        with open(temporary_path, 'wb') as raw_fp:
+            fp = COMPRESSIONS[compression][1](raw_fp, 'wb') if compression else raw_fp
+            for event in merged:
+                fp.write(encode_event(event))
+            if compression:
+                fp.close()  # writes the end of the compressed stream, leaving raw_fp open
+            raw_fp.flush()
+            os.fsync(raw_fp.fileno())
+            size = raw_fp.tell()
+        os.replace(temporary_path, self._path(file_name))
+        segments[month] = {'file': file_name, 'generation': generation, 'first': merged[0]['eventTime'],
+                           'last': merged[-1]['eventTime'], 'count': len(merged), 'size': size}
+        if compression:
+            segments[month]['compression'] = compression
+        if previous_file:
+            self._obsolete_files.append(previous_file)
+        return added
+
+    def _open(self):
+        """load the committed state of the store"""
+        self.manifest = self._load_manifest()
+        if 'watermarks' not in self.manifest:  # manifest written before watermarks were kept
+            self.manifest['watermarks'] = self._compute_watermarks()
+
+    def _compute_watermarks(self) -> dict:
+        """read every segment to find the last eventTime of each log value name"""
+        watermarks = {}
+        for month in self.manifest['segments']:
+            for event in self._read_segment(month):
+                name = event.get('name')
+                if name not in watermarks or event['eventTime'] > watermarks[name]:
+                    watermarks[name] = event['eventTime']
+        return watermarks
+
+    def _load_manifest(self) -> dict:
+        manifest_path = self._path(MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as fp:
+                return json.load(fp)
+        return {'last_event_time': None, 'watermarks': {}, 'segments': {}}
+
+    def _save_manifest(self):
+        atomic_write_json(self._path(MANIFEST_NAME), self.manifest)
+        for file_name in self._obsolete_files:  # files replaced by a merge are no longer referenced
+            os.remove(self._path(file_name))
+        self._obsolete_files = []
+
+    def _lock(self):
+        """wait for the writers of other processes and threads, then start from the manifest they committed"""
+        self._lock_fp = lock_file(self._path(LOCK_NAME))
+        try:
+            self._open()
+            self._recover()
+        except BaseException:
+            self._unlock()
+            raise
+
+    def _unlock(self):
+        self._lock_fp.close()
+        self._lock_fp = None
+
+    def _recover(self):
+        """drop what a crashed write left behind: uncommitted appended bytes and unreferenced files. Needs the lock."""
+        self._obsolete_files = []
+        referenced = {segment['file']: segment['size'] for segment in self.manifest['segments'].values()}
+        for file_name in os.listdir(self.directory):
+            if file_name in (MANIFEST_NAME, LOCK_NAME):
+                continue
+            file_path = self._path(file_name)
+            if file_name not in referenced:
+                os.remove(file_path)
+            elif os.path.getsize(file_path) > referenced[file_name]:
+                with open(file_path, 'rb+') as fp:
+                    fp.truncate(referenced[file_name])
+
+
+class HistoryWriter:
+    """
+    Add events one at a time to a HistoryStore. Nothing is visible in the store before the writer is closed: use it as
+    a context manager, an exception inside the block discards everything added. The store is locked from the creation
+    of the writer to its close.
+    """
+
+    def __init__(self, store: HistoryStore):
+        self.store = store
+        store._lock()
+        self.previous_watermarks = dict(store.manifest['watermarks'])
+        self.late_events = defaultdict(list)  # events not after the watermark of their name, by month
+        self.open_files = {}  # segment files opened for appending, by month
+        self.added = 0
+
+    def add(self, event: dict):
+        """
+        :param event: a log value as returned by getDevicesLogValues
+        """
+        segments = self.store.manifest['segments']
+        watermarks = self.store.manifest['watermarks']
+        time = event['eventTime']
+        month = time[:7]  # "YYYY-MM"
+        name = event.get('name')
+        if name in self.previous_watermarks and time <= self.previous_watermarks[name]:
+            self.late_events[month].append(event)
+            return
+        if name not in watermarks or time > watermarks[name]:
+            watermarks[name] = time
+        if 'compression' in segments.get(month, {}):  # compressed segments are rewritten, not appended to
+            self.late_events[month].append(event)
+            return
+        if month not in self.open_files:
+            segment = segments.setdefault(month, {'file': month + SEGMENT_EXTENSION, 'first': time, 'last': time,
+                                                  'count': 0, 'size': 0})
+            self.open_files[month] = open(self.store._path(segment['file']), 'ab')
+        self.open_files[month].write(encode_event(event))
+        segment = segments[month]
+        segment['first'] = min(segment['first'], time)
+        segment['last'] = max(segment['last'], time)
+        segment['count'] += 1
+        self.added += 1
+
+    def close(self, commit: bool = True):
+        """
+        :param commit: if True, merge the late events not stored yet and save the manifest, if anything was added.
+        If False, forget everything added.
+        """
+        try:
+            self._close(commit)
+        finally:
+            self.store._unlock()
+
+    def _close(self, commit: bool):
+        segments = self.store.manifest['segments']
+        changed = bool(self.open_files)
+        for month, fp in self.open_files.items():
+            fp.flush()
+            os.fsync(fp.fileno())
+            segments[month]['size'] = fp.tell()
+            fp.close()
+        self.open_files = {}
+        if not commit:
+            self.store._open()  # back to the committed manifest
+            self.store._recover()  # dropping the appended bytes
+            self.added = 0
+            return
+        for month, events in self.late_events.items():
+            events = self.store._new_events(month, events)  # mostly the overlap asked again, already stored
+            if events:
+                self.added += self.store._merge_segment(month, events)
+                changed = True
+        self.late_events.clear()
+        if not changed:  # nothing new: the segments and manifest stay as they are
+            return
+        if segments:
+            self.store.manifest['last_event_time'] = max(segment['last'] for segment in segments.values())
+        if self.store.compression:
+            self.store._compress_closed_segments(self.store.compression)  # usually none, one when a month ends
+        self.store._save_manifest()
+
+    def __enter__(self) -> 'HistoryWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
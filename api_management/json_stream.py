@@ -0,0 +1,79 @@
+"""
+Streaming parser for the JSON arrays returned by SLV.
+
+iter_json_array reads a response chunk by chunk with iter_content and yields the elements of the top level array one
+at a time, so that only one chunk and one element are in memory at once, whatever the size of the response. Ask for
+the response with stream=True so that requests does not download the whole body first.
+"""
+
+import codecs
+import json
+from typing import Iterator
+
+import requests
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = ',]' + WHITESPACE  # characters which can follow a value of the array
+
+
+def iter_json_array(response: requests.Response, chunk_size: int = 64 * 1024) -> Iterator:
+    """
+    Yield the elements of the JSON array held by the body of response.
+    :param response: response whose body is a JSON array, preferably obtained with stream=True
+    :param chunk_size: number of bytes read at once
+    :return: generator of the decoded elements
+    :raises ValueError: if the body is not a valid JSON array
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    chunks = response.iter_content(chunk_size)
+    buffer = ''
+    position = 0
+    exhausted = False
+    expected = '['  # '[' at the start, then a value and ',' alternately
+
+    while True:
+        if position > chunk_size:  # forget what has already been parsed
+            buffer = buffer[position:]
+            position = 0
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+        complete = position < len(buffer)
+        if complete:
+            character = buffer[position]
+            if expected == '[':
+                if character != '[':
+                    raise ValueError("expected a JSON array, got {!r}".format(buffer[position:position + 50]))
+                position += 1
+                expected = 'first value'
+                continue
+            if character == ']' and expected != 'value':
+                return
+            if expected == ',':
+                if character != ',':
+                    raise ValueError("expected ',' or ']' in JSON array, got {!r}".format(character))
+                position += 1
+                expected = 'value'
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # an object, array or string ends with its closing character, but a number or literal cut by the end
+                # of a chunk (12. or 1e) decodes too: it is only complete if a delimiter follows it
+                complete = character in '{["' or exhausted or (end < len(buffer) and buffer[end] in DELIMITERS)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                complete = False
+            if complete:
+                position = end
+                expected = ','
+                yield value
+                continue
+        if exhausted:  # more data is needed but there is none
+            raise ValueError("unexpected end of JSON array")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
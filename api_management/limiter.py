@@ -0,0 +1,203 @@
+"""
+Rate and concurrency limiter of the calls made to an SLV server.
+
+get_limiter gives one limiter per server, configured by settings.SLV_LIMITER_OPTIONS, which every SLVClient of the
+server shares unless it is given a limiter of its own, e.g. by a benchmark. Its rate is the budget of the whole process.
+
+A token bucket caps the number of requests per second. On top of it, the number of calls in flight is limited by a
+window adapted as in TCP congestion control (AIMD): each call which went well raises the window by 1 / window, so by
+about one per window of calls, and a sign of overload divides it by decrease_factor. The signs of overload are a 429,
+a 5xx, a connection error or timeout, and a latency above latency_factor times the usual latency of the api_method.
+Only calls started after the last decrease can decrease it again, so that a burst of errors caused by the previous
+window only counts once. A 429 with a Retry-After header also stops new calls for that long.
+
+The state of each limiter is given by state() and, in the Prometheus text format, by render_limiters().
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from settings import SLV_LIMITER_OPTIONS
+from .metrics import counter_lines
+
+logger = logging.getLogger('api_management.limiter')
+
+BASELINE_DRIFT = 0.01  # how fast the usual latency of an api_method rises towards slower calls
+MIN_LATENCY_SPIKE = 0.2  # seconds: latencies below this are never a spike, however low the usual latency
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst stored. Thread-safe."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        take a token, waiting for one if needed
+        :return: the seconds waited
+        """
+        waited = 0.
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """hand out no token for the next seconds, or longer if an earlier pause ends later"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class AdaptiveLimiter:
+    """token bucket and AIMD concurrency window for the calls to one server. Thread-safe."""
+
+    def __init__(self, rate: float = 20., burst: float = 20., initial_limit: float = 4., min_limit: float = 1.,
+                 max_limit: float = 32., decrease_factor: float = 2., latency_factor: float = 3.):
+        """
+        :param rate: requests per second, None for no rate limit
+        :param burst: requests which can be sent at once after a quiet time
+        :param initial_limit: calls in flight allowed at first
+        :param min_limit: the window never goes below it
+        :param max_limit: the window never goes above it
+        :param decrease_factor: the window is divided by it on a sign of overload
+        :param latency_factor: a call this many times slower than the usual latency of its api_method is a spike
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.waiting = 0
+        self.baselines = {}  # api_method -> usual latency in seconds
+        self.decreases = {}  # reason -> count
+        self.calls = 0
+        self.wait_seconds = 0.
+        self._last_decrease = 0.
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        wait for a token and a free place in the window
+        :return: the time the call starts, to give to release
+        """
+        waited = self.bucket.acquire() if self.bucket else 0.
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                started_waiting = time.monotonic()
+                self.waiting += 1
+                while self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                self.waiting -= 1
+                waited += time.monotonic() - started_waiting
+            self.in_flight += 1
+            self.calls += 1
+            self.wait_seconds += waited
+        return time.monotonic()
+
+    def release(self, started: float, api_method: str, status_code: int = None, error: Exception = None,
+                retry_after: Optional[float] = None):
+        """
+        end a call and adapt the window to how it went
+        :param started: what acquire returned
+        :param api_method: function called on SLV server
+        :param status_code: status code of the answer, None if the call raised error
+        :param error: the exception raised by the call, if any
+        :param retry_after: seconds asked by a 429 Retry-After header
+        """
+        latency = time.monotonic() - started
+        with self._condition:
+            self.in_flight -= 1
+            reason = self._overload(api_method, latency, status_code, error)
+            if reason is None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif started >= self._last_decrease:
+                previous = self.limit
+                self.limit = max(self.min_limit, self.limit / self.decrease_factor)
+                self._last_decrease = time.monotonic()
+                self.decreases[reason] = self.decreases.get(reason, 0) + 1
+                logger.warning('slv_limit_decreased reason=%s api_method=%s latency=%.3f limit=%.1f->%.1f', reason,
+                               api_method, latency, previous, self.limit)
+            self._condition.notify_all()
+        if retry_after and self.bucket:
+            self.bucket.pause(retry_after)
+
+    def _overload(self, api_method: str, latency: float, status_code: int, error: Exception) -> Optional[str]:
+        """the sign of overload given by a call, None if it went well. Updates the usual latency of api_method."""
+        if error is not None:
+            return 'error'
+        if status_code == 429:
+            return 'throttled'
+        if status_code >= 500:
+            return 'server_error'
+        baseline = self.baselines.get(api_method)
+        if baseline is not None and latency > max(MIN_LATENCY_SPIKE, self.latency_factor * baseline):
+            return 'latency'
+        if baseline is None or latency < baseline:
+            self.baselines[api_method] = latency
+        else:
+            self.baselines[api_method] = baseline + BASELINE_DRIFT * (latency - baseline)
+        return None
+
+    def state(self) -> dict:
+        """current window, calls in flight and waiting, tokens left and what happened so far"""
+        with self._condition:
+            return {'limit': self.limit, 'in_flight': self.in_flight, 'waiting': self.waiting,
+                    'rate': self.bucket.rate if self.bucket else None,
+                    'tokens': self.bucket.tokens if self.bucket else None, 'calls': self.calls,
+                    'wait_seconds': self.wait_seconds, 'decreases': dict(self.decreases),
+                    'baselines': dict(self.baselines)}
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}  # url -> limiter
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url: str) -> AdaptiveLimiter:
+    """
+    Return the limiter of the server at url, creating it with SLV_LIMITER_OPTIONS on first use, so that every client
+    of a server shares it.
+    :param url: the URL of the website
+    """
+    with _limiters_lock:
+        if url not in _limiters:
+            _limiters[url] = AdaptiveLimiter(**SLV_LIMITER_OPTIONS)
+        return _limiters[url]
+
+
+def render_limiters() -> str:
+    """the state of every limiter in the Prometheus text exposition format"""
+    with _limiters_lock:
+        states = {url: limiter.state() for url, limiter in _limiters.items()}
+    lines = []
+    for name, description, kind, key in (
+            ('slv_limiter_concurrency_limit', 'Calls in flight allowed by the adaptive window', 'gauge', 'limit'),
+            ('slv_limiter_in_flight', 'Calls in flight through the limiter', 'gauge', 'in_flight'),
+            ('slv_limiter_waiting', 'Calls waiting for a place in the window', 'gauge', 'waiting'),
+            ('slv_limiter_tokens', 'Tokens left in the rate limiting bucket', 'gauge', 'tokens'),
+            ('slv_limiter_calls_total', 'Calls let through the limiter', 'counter', 'calls'),
+            ('slv_limiter_wait_seconds_total', 'Seconds waited by calls in the limiter', 'counter', 'wait_seconds')):
+        lines += counter_lines(name, description, kind, {url: state[key] for url, state in states.items()
+                                                         if state[key] is not None}, ('server',))
+    lines += counter_lines('slv_limiter_decreases_total', 'Window decreases by sign of overload', 'counter',
+                           {(url, reason): count for url, state in states.items()
+                            for reason, count in state['decreases'].items()}, ('server', 'reason'))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,51 @@
+"""
+Merge engine for SLV log values, the events returned by getDevicesLogValues.
+
+An event is identified by its (eventTime, name, deviceId) key. SLV writes eventTime as "%Y-%m-%d %H:%M:%S", so
+comparing the strings gives the same order as comparing the dates and no timestamp needs to be parsed.
+"""
+
+from heapq import merge
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+event_time = itemgetter('eventTime')  # sort key of an event
+
+
+def event_key(event: dict) -> tuple:
+    """
+    :param event: a log value as returned by SLV
+    :return: the (eventTime, name, deviceId) tuple identifying the event
+    """
+    return event['eventTime'], event.get('name'), event.get('deviceId')
+
+
+def iter_unique_events(events: Iterable[dict]) -> Iterator[dict]:
+    """
+    Drop duplicated events from events sorted by eventTime, keeping the first occurrence. Duplicates share the same
+    eventTime, so only the keys of the current eventTime are kept in memory.
+    :param events: events sorted by eventTime
+    :return: generator of the unique events, in the same order
+    """
+    current_time = None
+    seen = set()
+    for event in events:
+        key = event_key(event)
+        if key[0] != current_time:  # a new eventTime, previous keys cannot appear again
+            current_time = key[0]
+            seen = set()
+        if key not in seen:
+            seen.add(key)
+            yield event
+
+
+def merge_log_values(history: list, values: list) -> list:
+    """
+    Merge new log values into the history, sorted by eventTime and without duplicates.
+    :param history: events already historized, normally sorted by eventTime
+    :param values: new events, in any order
+    :return: the merged list. On equal eventTime, history events come before new ones.
+    """
+    history = sorted(history, key=event_time)  # linear time when history is already sorted
+    values = sorted(values, key=event_time)
+    return list(iter_unique_events(merge(history, values, key=event_time)))
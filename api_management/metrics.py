@@ -0,0 +1,189 @@
+"""
+Metrics of the calls made to SLV, recorded by SLVClient.
+
+For each api_method: a histogram of call durations (retries included, up to the response headers), the number of
+answers per status code, the bytes received, the retries, the errors raised, the calls in flight and the answers
+served from the response cache. Each call is also logged on the 'api_management.slv' logger as key=value pairs.
+
+Metrics live in the memory of the process: with several server processes, each one exposes its own.
+
+RequestTimings adds up, for one request of the website, the time spent in SLV calls and other parts such as the
+database, when they run in the thread of the request.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger('api_management.slv')
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120.)  # upper bounds in seconds
+
+
+class Histogram:
+    """histogram with fixed bounds: counts[i] is the number of observations in (bounds[i - 1], bounds[i]]"""
+
+    def __init__(self, bounds: tuple = DURATION_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is above every bound
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class SLVMetrics:
+    """thread-safe counters of the SLV calls, by api_method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(Histogram)  # api_method -> Histogram
+        self.responses = defaultdict(int)  # (api_method, status code) -> count
+        self.bytes = defaultdict(int)  # api_method -> bytes received
+        self.retries = defaultdict(int)  # api_method -> retries
+        self.errors = defaultdict(int)  # (api_method, exception name) -> count
+        self.in_flight = defaultdict(int)  # api_method -> calls in progress
+        self.cache_hits = defaultdict(int)  # api_method -> answers read from the response cache
+
+    def call_started(self, api_method: str):
+        with self._lock:
+            self.in_flight[api_method] += 1
+
+    def call_finished(self, api_method: str, duration: float, retries: int, status_code: int = None,
+                      error: Exception = None):
+        """
+        :param api_method: function called on SLV server
+        :param duration: seconds from the first attempt to the last response headers or error
+        :param retries: attempts after the first one
+        :param status_code: status code of the last response, None if the call raised error
+        :param error: the exception raised by the call, if any
+        """
+        with self._lock:
+            self.in_flight[api_method] -= 1
+            self.durations[api_method].observe(duration)
+            self.retries[api_method] += retries
+            if error is None:
+                self.responses[api_method, status_code] += 1
+            else:
+                self.errors[api_method, type(error).__name__] += 1
+        logger.info('slv_call api_method=%s status=%s duration=%.3f retries=%d error=%s', api_method, status_code,
+                    duration, retries, type(error).__name__ if error else None,
+                    extra={'api_method': api_method, 'status_code': status_code, 'duration': duration,
+                           'retries': retries})
+        timings = request_timings()
+        if timings is not None:
+            timings.add('slv', duration)
+
+    def bytes_received(self, api_method: str, size: int):
+        with self._lock:
+            self.bytes[api_method] += size
+        timings = request_timings()
+        if timings is not None:
+            timings.add('slv', count=0, size=size)
+
+    def cache_hit(self, api_method: str):
+        with self._lock:
+            self.cache_hits[api_method] += 1
+
+    def render(self) -> str:
+        """the metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = ['# HELP slv_request_duration_seconds Duration of SLV calls, retries included',
+                     '# TYPE slv_request_duration_seconds histogram']
+            for api_method, histogram in sorted(self.durations.items()):
+                cumulated = 0
+                for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                    cumulated += count
+                    lines.append('slv_request_duration_seconds_bucket{{api_method="{}",le="{}"}} {}'.format(
+                        api_method, bound, cumulated))
+                lines.append('slv_request_duration_seconds_sum{{api_method="{}"}} {}'.format(api_method,
+                                                                                           histogram.sum))
+                lines.append('slv_request_duration_seconds_count{{api_method="{}"}} {}'.format(api_method,
+                                                                                             histogram.count))
+            lines += counter_lines('slv_responses_total', 'SLV answers by status code', 'counter',
+                                   self.responses, ('api_method', 'status_code'))
+            lines += counter_lines('slv_errors_total', 'SLV calls which raised an exception', 'counter',
+                                   self.errors, ('api_method', 'error'))
+            lines += counter_lines('slv_response_bytes_total', 'Bytes received from SLV', 'counter', self.bytes,
+                                   ('api_method',))
+            lines += counter_lines('slv_retries_total', 'SLV calls retried', 'counter', self.retries,
+                                   ('api_method',))
+            lines += counter_lines('slv_in_flight', 'SLV calls in progress', 'gauge', self.in_flight,
+                                   ('api_method',))
+            lines += counter_lines('slv_cache_hits_total', 'SLV answers read from the response cache', 'counter',
+                                   self.cache_hits, ('api_method',))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            for values in (self.durations, self.responses, self.bytes, self.retries, self.errors, self.cache_hits):
+                values.clear()
+
+
+def counter_lines(name: str, description: str, kind: str, values: Dict, labels: tuple) -> list:
+    """Prometheus text lines of one metric, values being keyed by the label values (a tuple if several labels)"""
+    lines = ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, kind)]
+    for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+        label_values = key if isinstance(key, tuple) else (key,)
+        lines.append('{}{{{}}} {}'.format(name, ','.join('{}="{}"'.format(label, label_value)
+                                                         for label, label_value in zip(labels, label_values)), value))
+    return lines
+
+
+slv_metrics = SLVMetrics()  # metrics of every SLVClient of the process
+
+
+class RequestTimings:
+    """seconds, occurrences and bytes of each part of one request, e.g. 'slv', 'db', 'json' or 'template'"""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.sizes = defaultdict(int)
+
+    def add(self, part: str, duration: float = 0., count: int = 1, size: int = 0):
+        self.durations[part] += duration
+        self.counts[part] += count
+        self.sizes[part] += size
+
+
+_local = threading.local()
+
+
+def start_request_timings() -> RequestTimings:
+    """start recording the timings of the current thread"""
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def stop_request_timings() -> Optional[RequestTimings]:
+    """stop recording the timings of the current thread and return them"""
+    timings = request_timings()
+    _local.timings = None
+    return timings
+
+
+def request_timings() -> Optional[RequestTimings]:
+    """the timings being recorded in the current thread, None if none are"""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timing(part: str):
+    """add the time spent in the block to part of the current timings, if any are being recorded"""
+    timings = request_timings()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(part, time.perf_counter() - started)
@@ -0,0 +1,118 @@
+"""
+On-disk cache of SLV answers for the calls whose data changes slowly (controllers, devices, geozones...).
+
+Entries are content addressed: the file name is a hash of (api_part, api_method, normalized parameters). Each method
+has its own time to live, methods without one are never cached. The total size of the cache is capped, the least
+recently used entries being evicted first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Union, Optional, Dict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from webob.multidict import MultiDict
+
+ENTRY_EXTENSION = '.cache'
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')  # not true any more for the cached body
+
+
+class ResponseCache:
+    """Cache of SLV responses stored in directory, one file per entry"""
+
+    def __init__(self, directory: str, ttl: Dict[str, timedelta], max_bytes: int = 50 * 1024 * 1024):
+        """
+        :param directory: where entries are stored. It is created if needed.
+        :param ttl: time to live of the answers of each api_method. Other methods are not cached.
+        :param max_bytes: size above which the least recently used entries are evicted
+        """
+        self.directory = directory
+        self.ttl = {api_method: duration.total_seconds() for api_method, duration in ttl.items()}
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # one eviction at a time
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(api_part: str, api_method: str, params: Union[dict, MultiDict]) -> str:
+        """
+        :return: the hash identifying a call, whatever the order of its parameters
+        """
+        normalized = sorted((str(name), str(value)) for name, value in params.items())
+        return hashlib.sha256(json.dumps([api_part, api_method, normalized]).encode()).hexdigest()
+
+    def get(self, api_part: str, api_method: str, params: Union[dict, MultiDict]) -> Optional[requests.Response]:
+        """
+        :return: the cached response if there is one younger than the time to live of api_method, else None
+        """
+        if api_method not in self.ttl:
+            return None
+        entry_path = self._path(self.key(api_part, api_method, params))
+        try:
+            with open(entry_path, 'rb') as fp:
+                meta = json.loads(fp.readline())
+                if time.time() - meta['stored_at'] > self.ttl[api_method]:
+                    return None
+                body = fp.read()
+            os.utime(entry_path)  # the modification time marks the last use, for LRU eviction
+        except (FileNotFoundError, ValueError):
+            return None
+        r = requests.Response()
+        r.status_code = meta['status_code']
+        r.reason = meta['reason']
+        r.url = meta['url']
+        r.encoding = meta['encoding']
+        r.headers = CaseInsensitiveDict(meta['headers'])
+        r._content = body
+        r._content_consumed = True
+        return r
+
+    def set(self, api_part: str, api_method: str, params: Union[dict, MultiDict], response: requests.Response):
+        """
+        Store a successful response of a cached api_method, then evict entries if the cache is too big.
+        """
+        if api_method not in self.ttl or response.status_code != 200:
+            return
+        meta = {'stored_at': time.time(), 'status_code': response.status_code, 'reason': response.reason,
+                'url': response.url, 'encoding': response.encoding,
+                'headers': {name: value for name, value in response.headers.items()
+                            if name.lower() not in DROPPED_HEADERS}}
+        entry_path = self._path(self.key(api_part, api_method, params))
+        temporary_path = '{}.{}.tmp'.format(entry_path, threading.get_ident())
+        with open(temporary_path, 'wb') as fp:
+            fp.write(json.dumps(meta).encode() + b'\n')
+            fp.write(response.content)
+        os.replace(temporary_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """remove the least recently used entries until the cache holds at most max_bytes"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(ENTRY_EXTENSION):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for last_use, size, entry_path in entries)
+            for last_use, size, entry_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        """remove every entry"""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_EXTENSION):
+                os.remove(entry.path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_EXTENSION)
@@ -0,0 +1,67 @@
+"""
+In-memory cache of computed results with single-flight computation.
+
+Entries are kept in least recently used order, each with its own time to live (None meaning forever). When several
+threads ask for the same missing key at once, only the first one computes it, the others wait for its result.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+
+class ResultCache:
+    """LRU cache of at most max_entries results, computing each missing key once however many threads ask for it"""
+
+    def __init__(self, max_entries: int = 128):
+        """
+        :param max_entries: number of results kept, the least recently used ones are dropped first
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expiry time or None, value)
+        self._in_flight = {}  # key -> Future of the computation in progress
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None,
+                       cache_if: Callable[[Any], bool] = None) -> Any:
+        """
+        :param key: identifies the result
+        :param compute: function called without argument to compute a missing result
+        :param ttl: seconds during which the result stays valid, None to keep it until it is evicted
+        :param cache_if: if given, a computed result is only stored when cache_if(result) is True
+        :return: the cached or computed result. If the computation raises, every waiting caller gets the error.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > monotonic()):
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._in_flight.get(key)
+            computing = future is None
+            if computing:
+                future = self._in_flight[key] = Future()
+        if not computing:  # another thread is already computing it
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as error_caught:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error_caught)
+            raise
+        with self._lock:
+            if cache_if is None or cache_if(value):
+                self._entries[key] = (None if ttl is None else monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        """drop every result"""
+        with self._lock:
+            self._entries.clear()
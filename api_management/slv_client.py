@@ -0,0 +1,160 @@
+"""
+Pooled, keep-alive HTTP client for the StreetLight Vision (SLV) API.
+
+A single SLVClient holds one requests.Session, so every call made through it reuses the same small set of warm
+TCP connections and the same credentials instead of opening a new connection for each call_SLV_* function.
+GET answers of slow-changing methods can also be served from a ResponseCache. Every call is recorded in
+metrics.slv_metrics, and every attempt goes through the AdaptiveLimiter shared by all clients of the server.
+"""
+
+import json
+import threading
+import time
+from typing import Union, Tuple, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from webob.multidict import MultiDict
+
+from .limiter import AdaptiveLimiter, get_limiter
+from .metrics import SLVMetrics, slv_metrics
+from .response_cache import ResponseCache
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)  # throttling and server errors worth retrying
+
+
+class SLVClient:
+    """Keep-alive connection pool to an SLV server, with timeouts and retry/backoff on 5xx and connection resets."""
+
+    def __init__(self, url: str, authentication: tuple, pool_size: int = 10,
+                 timeout: Union[float, Tuple[float, float]] = (10, 120), retries: int = 3,
+                 backoff_factor: float = 0.5, cache_options: dict = None, metrics: SLVMetrics = slv_metrics,
+                 limiter: AdaptiveLimiter = None):
+        """
+        :param url: the URL of the website
+        :param authentication: tuple giving ('identifier','password')
+        :param pool_size: maximum number of simultaneous connections kept alive to the server
+        :param timeout: (connect, read) timeout in seconds given to each call
+        :param retries: number of times a call is retried on a 5xx answer or a connection reset
+        :param backoff_factor: sleep backoff_factor * 2 ** attempt seconds between two attempts
+        :param cache_options: ResponseCache arguments (directory, ttl, max_bytes). No cache if None.
+        :param metrics: where the calls are recorded
+        :param limiter: limiter of the calls, defaults to the one shared by every client of the server
+        """
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.cache = ResponseCache(**cache_options) if cache_options else None
+        self.metrics = metrics
+        self.limiter = limiter or get_limiter(url)
+        self.session = requests.Session()
+        self.session.auth = authentication  # credentials are set once for the whole session
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, api_part: str, api_method: str, params: Union[dict, MultiDict], stream: bool = False,
+            refresh: bool = False) -> requests.Response:
+        """
+        GET url + api_part + api_method with the given query parameters, from the cache when api_method is cached
+        :param refresh: if True, do not read the cache but still store the new answer in it
+        """
+        if self.cache and not refresh:
+            cached = self.cache.get(api_part, api_method, params)
+            if cached is not None:
+                self.metrics.cache_hit(api_method)
+                return cached
+        r = self.request('GET', api_part, api_method, stream=stream, params=params)
+        if self.cache:
+            self.cache.set(api_part, api_method, params, r)
+        return r
+
+    def post(self, api_part: str, api_method: str, data: Union[dict, MultiDict],
+             stream: bool = False) -> requests.Response:
+        """POST url + api_part + api_method with the given form parameters"""
+        return self.request('POST', api_part, api_method, stream=stream, data=data)
+
+    def request(self, http_method: str, api_part: str, api_method: str, stream: bool = False,
+                **kwargs) -> requests.Response:
+        """
+        Send the request, retrying on 429 and 5xx answers and connection resets. Each attempt waits for the limiter,
+        which is released once the response headers are received.
+        :param http_method: 'GET' or 'POST'
+        :param api_part: where the function is on SLV server, e.g. '/api/asset/'
+        :param api_method: function which gets called on SLV server
+        :param stream: if True the body is not downloaded until it is read
+        :return: the last response obtained. A 429 or 5xx response is returned once retries are exhausted.
+        """
+        full_url = self.url + api_part + api_method
+        attempt = 0
+        self.metrics.call_started(api_method)
+        started = time.perf_counter()
+        while True:
+            attempt_started = self.limiter.acquire()
+            try:
+                r = self.session.request(http_method, full_url, timeout=self.timeout, stream=stream, **kwargs)
+            except requests.RequestException as error:
+                self.limiter.release(attempt_started, api_method, error=error)
+                if not isinstance(error, requests.ConnectionError) or attempt >= self.retries:
+                    self.metrics.call_finished(api_method, time.perf_counter() - started, attempt, error=error)
+                    raise
+            else:
+                retry_after = r.headers.get('Retry-After', '')
+                self.limiter.release(attempt_started, api_method, r.status_code,
+                                     retry_after=float(retry_after) if retry_after.isdigit() else None)
+                if r.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    self.metrics.call_finished(api_method, time.perf_counter() - started, attempt, r.status_code)
+                    self.count_bytes(api_method, r, stream)
+                    return r
+                r.close()  # give the connection back to the pool before retrying
+            time.sleep(self.backoff_factor * 2 ** attempt)
+            attempt += 1
+
+    def count_bytes(self, api_method: str, r: requests.Response, stream: bool):
+        """
+        Record the size of the body of r: from its Content-Length, or from the body itself once it is read. A streamed
+        chunked body is counted as its chunks go by, so that nothing is read ahead of the caller.
+        """
+        length = r.headers.get('Content-Length')
+        if length is not None and length.isdigit():
+            self.metrics.bytes_received(api_method, int(length))
+        elif not stream:
+            self.metrics.bytes_received(api_method, len(r.content))
+        else:
+            raw_stream = r.raw.stream
+
+            def counted_stream(*args, **kwargs):
+                size = 0
+                try:
+                    for chunk in raw_stream(*args, **kwargs):
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    self.metrics.bytes_received(api_method, size)
+
+            r.raw.stream = counted_stream
+
+    def close(self):
+        """close all pooled connections"""
+        self.session.close()
+
+
+_clients: Dict[tuple, SLVClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url: str, authentication: tuple, **kwargs) -> SLVClient:
+    """
+    Return the shared SLVClient for this server, these credentials and options, creating it on first use, so that one
+    run reuses the same connections across every call_SLV_* call.
+    :param url: the URL of the website
+    :param authentication: tuple giving ('identifier','password')
+    :param kwargs: SLVClient options. Callers giving other options get another client.
+    :return: the shared client
+    """
+    key = (url, tuple(authentication), json.dumps(kwargs, sort_keys=True, default=repr))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SLVClient(url, authentication, **kwargs)
+        return _clients[key]
@@ -0,0 +1,11 @@
+"""
+Run every benchmark with its default sizes.
+
+usage: python -m benchmarks
+"""
+
+from . import bench_crawl, bench_end_to_end, bench_historize
+
+for benchmark in (bench_historize, bench_crawl, bench_end_to_end):
+    print('\n' + benchmark.__name__)
+    benchmark.main([])
@@ -0,0 +1,52 @@
+"""
+Benchmark of the SLV crawls against a fake SLV server: getControllerDevices for every controller, with
+crawl_electric_counters, and the geozone tree, with crawl_geozones.
+
+Each SLV answer waits --latency seconds, the way a remote server does, so the results show how well calls overlap.
+Calls go through a limiter of their own, without rate limit unless --rate is given.
+
+usage: python -m benchmarks.bench_crawl [--sizes 10 100 1000] [--latency 0.05] [--workers 8] [--error-rate 0]
+                                        [--rate 20]
+"""
+
+import argparse
+
+from api_management.api_calls import crawl_electric_counters
+from api_management.fake_slv import FakeFleet, FakeSLVServer, ROOT_GEOZONE_ID
+from api_management.geozones import crawl_geozones
+from api_management.limiter import AdaptiveLimiter
+from api_management.slv_client import SLVClient
+from .common import timed, quiet
+
+AUTHENTICATION = ('benchmark', 'benchmark')
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='controllers in the fleet')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds waited by the server before answering')
+    parser.add_argument('--workers', type=int, default=8, help='calls in flight')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of answers which are 503 errors')
+    parser.add_argument('--rate', type=float, help='requests per second allowed by the limiter')
+    args = parser.parse_args(argv)
+    print('{:>12} {:>10} {:>12} {:>10} {:>12} {:>10} {:>8}'.format(
+        'controllers', 'crawl (s)', 'calls/s', 'geozones', 'tree (s)', 'calls/s', 'errors'))
+    with FakeSLVServer(FakeFleet(0), latency=args.latency, error_rate=args.error_rate) as server:
+        for size in args.sizes:
+            server.fleet = FakeFleet(size)
+            client = SLVClient(server.url, AUTHENTICATION, pool_size=args.workers, backoff_factor=0.01,
+                               limiter=AdaptiveLimiter(rate=args.rate, initial_limit=args.workers,
+                                                       max_limit=args.workers))
+            with quiet():
+                (counters, counter_ids, errors), crawl_time = timed(
+                    crawl_electric_counters, server.url, AUTHENTICATION, max_workers=args.workers, client=client)
+                (tree, tree_errors), tree_time = timed(crawl_geozones, server.url, AUTHENTICATION, ROOT_GEOZONE_ID,
+                                                       max_workers=args.workers, client=client)
+            client.close()
+            print('{:>12} {:>10.2f} {:>12.1f} {:>10} {:>12.2f} {:>10.1f} {:>8}'.format(
+                size, crawl_time, (size + 1) / crawl_time, len(tree.geozones), tree_time,
+                len(tree.geozones) / tree_time, len(errors) + len(tree_errors)))
+
+
+if __name__ == '__main__':
+    main()
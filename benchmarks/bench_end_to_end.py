@@ -0,0 +1,100 @@
+"""
+End-to-end benchmark against a fake SLV server and a test database: topology sync, log values ingestion, then the
+latency of the views over the ingested range.
+
+For each fleet size the database and history stores start empty. sync_topology creates the Devices and SubDevices,
+every electric counter is then updated from scratch (LOG_VALUES_BACKFILL of history) with update_log_values_in_batches,
+and each view is requested --repeat times through the Django test client.
+
+usage: python -m benchmarks.bench_end_to_end [--sizes 10 50 200] [--latency 0.05] [--repeat 20]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from api_management.fake_slv import FakeFleet, FakeSLVServer, COUNTER_NAMES
+from .common import timed, quiet, latencies, latency_line, setup_django
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200], help='controllers in the fleet')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds waited by the server before answering')
+    parser.add_argument('--repeat', type=int, default=20, help='requests of each view')
+    args = parser.parse_args(argv)
+    work_dir = tempfile.mkdtemp()
+    with FakeSLVServer(FakeFleet(0), latency=args.latency) as server:
+        setup_django(server.url, work_dir)
+        from django.test import Client
+        from api_management.api_calls import call_SLV_getAllControllers, crawl_controller_devices
+        from api_management.json_stream import iter_json_array
+        from raw_extractions.forms import controller_choices_cache
+        from raw_extractions.ingestion import update_log_values_in_batches
+        from raw_extractions.models import ControllerType, EnergyName, SubDevice, Device, LogValue
+        from raw_extractions.topology import sync_topology
+        from raw_extractions.views import raw_data_cache
+        from settings import SLV_URL, logi, LOG_VALUES_BACKFILL, LOG_VALUES_BATCH_SIZE, ELECTRIC_COUNTER_CATEGORY
+        category = ControllerType.objects.create(category=ELECTRIC_COUNTER_CATEGORY)
+        for name in COUNTER_NAMES:
+            EnergyName.objects.create(name=name, category=category)
+        for size in args.sizes:
+            LogValue.objects.all().delete()
+            SubDevice.objects.all().delete()  # rollups and switching days go with them
+            Device.objects.all().delete()
+            shutil.rmtree(os.path.join(work_dir, 'history'), ignore_errors=True)
+            raw_data_cache.clear()
+            controller_choices_cache.clear()
+            server.fleet = FakeFleet(size, history_days=LOG_VALUES_BACKFILL.days + 1)
+            print('{} controllers'.format(size))
+
+            def sync():
+                controllers = [elt['controllerDevice'] for elt in iter_json_array(
+                    call_SLV_getAllControllers(SLV_URL, logi, 'json', stream=True, refresh=True))]
+                devices, errors = crawl_controller_devices(SLV_URL, logi, [controller['controllerStrId']
+                                                                           for controller in controllers],
+                                                           refresh=True)
+                return sync_topology(controllers, devices)
+
+            with quiet():
+                summary, sync_time = timed(sync)
+                counters = list(SubDevice.objects.filter(category__category=ELECTRIC_COUNTER_CATEGORY)
+                                .prefetch_related('energy_names'))
+                (added, errors), ingest_time = timed(update_log_values_in_batches, counters, LOG_VALUES_BATCH_SIZE)
+            events = sum(added.values())
+            print('  sync_topology {:.2f} s for {} SubDevices, ingestion {:.2f} s for {} events ({:.0f} events/s), '
+                  '{} errors'.format(sync_time, summary['subdevices_created'], ingest_time, events,
+                                     events / ingest_time, len(errors)))
+
+            client = Client()
+            device_id = counters[0].device_id
+            end = server.fleet.end.replace(hour=0)
+            start = end - timedelta(days=LOG_VALUES_BACKFILL.days - 1)
+            dates = '{}-{}'.format(start.strftime('%d.%m.%Y'), end.strftime('%d.%m.%Y'))
+            result = '/result/{}-TotalKWHPositive-{}'.format(device_id, dates)
+            api = '/api/{}/TotalKWHPositive?from={}&to={}&resolution=hour'.format(device_id, start.date(), end.date())
+            etag = client.get(api)['ETag']
+            print('  {:<32} {:>10} {:>10} {:>10}'.format('view', 'mean (ms)', 'p50 (ms)', 'p95 (ms)'))
+            for label, url, headers, repeat in (
+                    ('raw_data_present', result, {}, args.repeat),
+                    ('raw_data_present overview', result + '?overview=1', {}, args.repeat),
+                    ('time_series hour', api, {}, args.repeat),
+                    ('time_series 304', api, {'HTTP_IF_NONE_MATCH': etag}, args.repeat),
+                    ('export csv', '/export/{}-TotalKWHPositive-{}.csv'.format(device_id, dates), {}, 3),
+                    ('export csv, whole fleet', '/export/all-TotalKWHPositive-{}.csv'.format(dates), {}, 1)):
+                print('  ' + latency_line(label, latencies(lambda: read(client.get(url, **headers)), repeat)))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def read(response):
+    """read the whole body of a response, streamed or not"""
+    if response.streaming:
+        for part in response.streaming_content:
+            pass
+    return response
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark of the log values merge used by historize_log_values.
+
+Compare the former quadratic dedupe + strptime sort with api_management.log_values.merge_log_values on a history of
+10-minute samples, merged with a 15-day batch overlapping its end, the way SubDevice.update_log_values does. The last
+column times the whole historize_log_values, json file read and write included.
+
+usage: python -m benchmarks.bench_historize [--sizes 10000 100000 1000000] [--legacy-max 10000]
+"""
+
+import argparse
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from api_management.api_calls import historize_log_values
+from api_management.file_writing import write_to_json_file
+from api_management.log_values import merge_log_values
+from .common import timed
+
+BATCH_SIZE = 15 * 24 * 6  # 15 days of 10-minute samples
+START = datetime(2018, 1, 1)  # time of the first synthetic sample
+
+
+def make_events(first: int, count: int, deviceId: int = 60320, name: str = 'TotalKWHPositive') -> list:
+    """build count synthetic log values, one every 10 minutes from sample number first"""
+    return [{'deviceId': deviceId, 'name': name, 'value': float(i),
+             'eventTime': (START + timedelta(minutes=10 * i)).strftime("%Y-%m-%d %H:%M:%S")}
+            for i in range(first, first + count)]
+
+
+def legacy_merge(historic: list, values: list) -> list:
+    """the merge historize_log_values used to do"""
+    historic = historic + values
+    unique = []
+    [unique.append(elem) for elem in historic if elem not in unique]
+    unique.sort(key=lambda event: datetime.strptime(event["eventTime"], "%Y-%m-%d %H:%M:%S"))
+    return unique
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=10000, help='largest size the legacy merge is run on')
+    args = parser.parse_args(argv)
+    print('{:>10} {:>12} {:>12} {:>10} {:>15}'.format('events', 'legacy (s)', 'merge (s)', 'speedup', 'historize (s)'))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            history = make_events(0, size)
+            batch = make_events(size - BATCH_SIZE // 2, BATCH_SIZE)
+            merged, merge_time = timed(merge_log_values, history, batch)
+            history_file = os.path.join(work_dir, 'history_{}'.format(size))
+            write_to_json_file(history_file, history)
+            _, historize_time = timed(historize_log_values, history_file, batch)
+            if size <= args.legacy_max:
+                expected, legacy_time = timed(legacy_merge, history, batch)
+                assert merged == expected, 'merge_log_values output differs from the legacy merge'
+                print('{:>10} {:>12.3f} {:>12.3f} {:>9.0f}x {:>15.3f}'.format(size, legacy_time, merge_time,
+                                                                             legacy_time / merge_time, historize_time))
+            else:
+                print('{:>10} {:>12} {:>12.3f} {:>10} {:>15.3f}'.format(size, '-', merge_time, '-', historize_time))
+
+
+if __name__ == '__main__':
+    main()
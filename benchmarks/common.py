@@ -0,0 +1,62 @@
+"""
+Helpers shared by the benchmarks: timing, latency statistics, and a Django set up against a throw-away test
+database and a fake SLV server.
+"""
+
+import os
+from contextlib import contextmanager, redirect_stdout
+from time import perf_counter
+from typing import List
+
+
+def timed(function, *args, **kwargs) -> tuple:
+    """return the result of function(*args, **kwargs) and the seconds it took"""
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+
+@contextmanager
+def quiet():
+    """silence the 'calling ...' lines printed by the call_SLV_* functions"""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def latencies(function, repeat: int) -> List[float]:
+    """seconds taken by each of repeat calls of function without argument"""
+    return [timed(function)[1] for i in range(repeat)]
+
+
+def percentile(samples: List[float], share: float) -> float:
+    """the sample below which share of the samples are, share being between 0 and 1"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def latency_line(label: str, samples: List[float]) -> str:
+    """one line of a latency table, in milliseconds"""
+    return '{:<32} {:>10.1f} {:>10.1f} {:>10.1f}'.format(label, 1000 * sum(samples) / len(samples),
+                                                        1000 * percentile(samples, 0.5),
+                                                        1000 * percentile(samples, 0.95))
+
+
+def setup_django(slv_url: str, work_dir: str):
+    """
+    Point the project at slv_url and work_dir, then set Django up on a test database, never the real one.
+    Must be called before anything imports raw_extractions, as its modules read settings when imported.
+    :param slv_url: URL of the SLV server, e.g. of a FakeSLVServer
+    :param work_dir: directory for the history stores, in its history sub-directory, and the response cache
+    """
+    import django
+    import settings
+    settings.SLV_URL = slv_url
+    settings.FILE_PATH_FIELD = os.path.join(work_dir, 'history', '')
+    settings.SLV_CLIENT_OPTIONS = dict(settings.SLV_CLIENT_OPTIONS, cache_options=dict(
+        settings.SLV_CLIENT_OPTIONS['cache_options'], directory=os.path.join(work_dir, 'slv_cache')))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'website_bsm.settings')
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
@@ -0,0 +1,84 @@
+"""
+CSV and XLSX exports of log values.
+
+Rows are read one at a time from the history store of each SubDevice, so an export never holds the whole range in
+memory. CSV lines are sent to the client as soon as they are written. XLSX workbooks are written by XlsxWriter in
+constant_memory mode, which flushes each row to disk, into a temporary file sent once it is complete: an XLSX file is
+a zip archive whose directory is only written at the end, so the client gets its first byte once the whole range is
+written. The CSV export is the one to use for large ranges.
+"""
+
+import csv
+import tempfile
+from datetime import datetime
+from typing import Iterable, Iterator
+
+import xlsxwriter
+
+from settings import XLSX_MAX_ROWS
+
+EXPORT_COLUMNS = ('deviceId', 'name', 'eventTime', 'value')
+
+
+def export_rows(subdevices: Iterable, name: str, start: datetime, end: datetime) -> Iterator[tuple]:
+    """
+    :param subdevices: SubDevice instances, exported one after the other
+    :param name: the log value name exported
+    :param start: first eventTime exported
+    :param end: last eventTime exported
+    :return: generator of (deviceId, name, eventTime, value) tuples, sorted by eventTime for each SubDevice
+    """
+    start, end = start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+    for subdevice in subdevices:
+        for event in subdevice.history_store(read_only=True).read_range(start, end):
+            if event.get('name') == name:
+                yield event.get('deviceId'), name, event['eventTime'], event.get('value')
+
+
+class Echo:
+    """file-like object whose write returns what it is given, so that csv.writer produces lines one at a time"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(rows: Iterable[tuple]) -> Iterator[str]:
+    """
+    :param rows: tuples of EXPORT_COLUMNS
+    :return: generator of the CSV lines, header first
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows: Iterable[tuple]) -> tempfile.NamedTemporaryFile:
+    """
+    Write rows to a workbook in a temporary file. A new worksheet is started every XLSX_MAX_ROWS rows, the limit of
+    Excel.
+    :param rows: tuples of EXPORT_COLUMNS
+    :return: the temporary file, open and rewound. It is deleted when it is closed.
+    """
+    output = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    workbook = xlsxwriter.Workbook(output.name, {'constant_memory': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    worksheet = None
+    row_number = XLSX_MAX_ROWS
+    for row in rows:
+        if row_number >= XLSX_MAX_ROWS:
+            worksheet = workbook.add_worksheet()
+            worksheet.set_column(2, 2, 20)
+            worksheet.write_row(0, 0, EXPORT_COLUMNS)
+            row_number = 1
+        deviceId, name, event_time, value = row
+        worksheet.write(row_number, 0, deviceId)
+        worksheet.write(row_number, 1, name)
+        worksheet.write_datetime(row_number, 2, datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S"), date_format)
+        worksheet.write(row_number, 3, value)
+        row_number += 1
+    if worksheet is None:  # no rows, still give a workbook with the header
+        workbook.add_worksheet().write_row(0, 0, EXPORT_COLUMNS)
+    workbook.close()
+    output.seek(0)
+    return output
@@ -1,11 +1,26 @@
 from django import forms
 from datetime import datetime
 
+from api_management.result_cache import ResultCache
+from settings import ELECTRIC_COUNTER_CATEGORY, FORM_CHOICES_TTL
+from .models import SubDevice
+
+controller_choices_cache = ResultCache(1)  # choices of RawDataForm.controller, read from the database
+
+
+def read_controller_choices() -> list:
+    """(device_id, controller) of every electric counter SubDevice"""
+    return list(SubDevice.objects.filter(category__category=ELECTRIC_COUNTER_CATEGORY).order_by(
+        'device_name__device_str').values_list('device_id', 'device_name__device_str'))
+
+
+def controller_choices() -> list:
+    """the choices of RawDataForm.controller, read from the database at most once every FORM_CHOICES_TTL"""
+    return controller_choices_cache.get_or_compute('controllers', read_controller_choices,
+                                                   ttl=FORM_CHOICES_TTL.total_seconds())
+
 
 class RawDataForm(forms.Form):
-    choice_list = ((60320, "CBC_BSM_A01"), (60321, "CBC_BSM_A02"), (60323, "CBC_BSM_A03"), (60604, "CBC_BSM_A04"), (
-        60626, "CBC_BSM_A05"), (59930, "CBC_BSM_A06"), (60278, "CBC_BSM_A08"), (60659, "CBC_BSM_A09"),
-                   (60325, "CBC_BSM_A10"))
-    controller = forms.ChoiceField(choices=choice_list)
+    controller = forms.ChoiceField(choices=controller_choices)
     start_date = forms.DateTimeField()
     end_date = forms.DateTimeField()
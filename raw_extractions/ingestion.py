@@ -0,0 +1,219 @@
+"""
+Ingestion of SLV log values into the history store of each SubDevice and into the LogValue table.
+
+Several SubDevices are updated with a single getDevicesLogValues call: the deviceId/name pairs of the whole batch
+are posted at once and the answer is parsed as a stream, each event going to the store of its SubDevice as soon as it
+is read. LogValue rows are written in large bulk_create batches inside one transaction per ingestion.
+"""
+
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Iterable, Tuple, Dict
+
+import requests
+from django.db import transaction
+from django.utils import timezone
+
+from api_management.api_calls import call_SLV_getDevicesLogValues
+from api_management.backfill import backfill_log_values
+from api_management.json_stream import iter_json_array
+from api_management.slv_client import SLVClient, get_client
+from settings import SLV_URL, logi, SLV_CLIENT_OPTIONS, LOG_VALUES_BACKFILL, LOG_VALUES_OVERLAP, \
+    LOG_VALUES_BACKFILL_WORKERS, LOG_VALUES_BULK_SIZE
+from .models import EnergyName, LogValue
+from .rollups import update_rollups
+from .switching import update_switching
+
+
+def parse_event_time(event_time: str) -> datetime:
+    """the aware datetime of an SLV eventTime"""
+    return timezone.make_aware(datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S"), timezone.utc)
+
+
+def parse_value(value) -> float:
+    """the numeric value of a log value, booleans giving 1.0 or 0.0, None if it is not a number"""
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return float(value.lower() == 'true')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LogValueIndex:
+    """
+    Write log values of some SubDevices to the LogValue table, LOG_VALUES_BULK_SIZE rows per bulk_create. Django splits
+    each bulk_create into the batches the database accepts, e.g. at most 500 rows per INSERT on SQLite.
+    """
+
+    def __init__(self, subdevices: Iterable):
+        self.subdevice_pks = {subdevice.device_id: subdevice.pk for subdevice in subdevices}
+        self.energy_name_pks = dict(EnergyName.objects.values_list('name', 'pk'))
+        self.energy_names = {pk: name for name, pk in self.energy_name_pks.items()}
+        self.rows = []
+        self.touched = {}  # {(subdevice_pk, energy name): (first, last)} times of the values inserted
+
+    def add(self, event: dict):
+        """
+        :param event: a log value as returned by getDevicesLogValues. Values of unknown energy names are not indexed.
+        """
+        energy_name_pk = self.energy_name_pks.get(event.get('name'))
+        if energy_name_pk is None:
+            return
+        self.rows.append(LogValue(subdevice_id=self.subdevice_pks[event['deviceId']], energy_name_id=energy_name_pk,
+                                  event_time=parse_event_time(event['eventTime']),
+                                  value=parse_value(event.get('value'))))
+        if len(self.rows) >= LOG_VALUES_BULK_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        write the pending rows, leaving out those already in the table, e.g. the overlap asked again, so that only the
+        rows inserted are touched
+        """
+        if not self.rows:
+            return
+        times = [row.event_time for row in self.rows]
+        existing = set(LogValue.objects.filter(
+            subdevice_id__in={row.subdevice_id for row in self.rows},
+            energy_name_id__in={row.energy_name_id for row in self.rows},
+            event_time__gte=min(times), event_time__lte=max(times)).values_list('subdevice_id', 'energy_name_id',
+                                                                                'event_time'))
+        rows = [row for row in self.rows if (row.subdevice_id, row.energy_name_id, row.event_time) not in existing]
+        LogValue.objects.bulk_create(rows, ignore_conflicts=True)  # a row inserted meanwhile is still ignored
+        for row in rows:
+            key = (row.subdevice_id, self.energy_names[row.energy_name_id])
+            first, last = self.touched.get(key, (row.event_time, row.event_time))
+            self.touched[key] = (min(first, row.event_time), max(last, row.event_time))
+        self.rows = []
+
+
+def ingest_log_values(subdevices: list, events: Iterable[dict]) -> Dict[int, int]:
+    """
+    Add events to the history store of their SubDevice and to the LogValue table, in one transaction, then update the
+    rollups and switching of the days touched by the rows inserted.
+    :param subdevices: SubDevice instances the events belong to
+    :param events: log values, read only once
+    :return: dict {device_id: number of events added to its store}
+    """
+    index = LogValueIndex(subdevices)
+    # the writers are committed together once all events are read, after the LogValue rows: if the database commit
+    # fails the writers are discarded, so the watermarks do not move and the next update fetches the events again.
+    # Each writer locks its store: they are always opened by device_id so that two ingestions cannot deadlock.
+    with ExitStack() as stack, transaction.atomic():
+        writers = {subdevice.device_id: stack.enter_context(subdevice.history_store().writer())
+                   for subdevice in sorted(subdevices, key=lambda subdevice: subdevice.device_id)}
+        for event in events:
+            writers[event['deviceId']].add(event)
+            index.add(event)
+        index.flush()
+    update_rollups(index.touched, index.energy_name_pks)
+    update_switching(index.touched, index.energy_name_pks)
+    return {device_id: writer.added for device_id, writer in writers.items()}
+
+
+class IndexedHistory:
+    """
+    History store of a SubDevice whose appended values are also written to LogValue. It can be filled where a
+    HistoryStore is expected, e.g. by backfill_log_values.
+    """
+
+    def __init__(self, subdevice):
+        self.subdevice = subdevice
+
+    def append(self, values: Iterable[dict]) -> int:
+        return ingest_log_values([self.subdevice], values)[self.subdevice.device_id]
+
+
+def energy_names(subdevice) -> list:
+    """names of the energy names of subdevice, using prefetched energy_names when there are"""
+    return [energy_name.name for energy_name in subdevice.energy_names.all()]
+
+
+def log_value_pairs(subdevices: Iterable) -> Tuple[list, list]:
+    """
+    :param subdevices: SubDevice instances
+    :return: the deviceId and name lists of getDevicesLogValues, one pair for each energy name of each SubDevice
+    """
+    device_ids = []
+    names = []
+    for subdevice in subdevices:
+        for name in energy_names(subdevice):
+            device_ids.append(subdevice.device_id)
+            names.append(name)
+    return device_ids, names
+
+
+def fetch_from(subdevice, now: datetime) -> datetime:
+    """
+    :param subdevice: SubDevice instance
+    :param now: the end of the update
+    :return: the date from which SLV must be asked for new values of subdevice
+    """
+    from_date = subdevice.history_store(read_only=True).fetch_from(energy_names(subdevice), LOG_VALUES_OVERLAP)
+    if from_date is None:
+        return now - LOG_VALUES_BACKFILL
+    return timezone.make_aware(from_date, timezone.utc)
+
+
+def update_log_values_batch(subdevices: list, client: SLVClient = None) -> Dict[int, int]:
+    """
+    Fetch the new log values of all subdevices with one getDevicesLogValues call and ingest them.
+    The call starts from the oldest date needed by one of the subdevices, the stores drop what they already hold.
+    :param subdevices: SubDevice instances
+    :param client: SLVClient to use, defaults to the shared client
+    :return: dict {device_id: number of events added}
+    """
+    client = client or get_client(SLV_URL, logi, **SLV_CLIENT_OPTIONS)
+    now = timezone.now()
+    device_ids, names = log_value_pairs(subdevices)
+    if not device_ids:
+        return {}
+    from_date = min(fetch_from(subdevice, now) for subdevice in subdevices)
+    r = call_SLV_getDevicesLogValues(SLV_URL, logi, 'json', device_ids, names,
+                                     from_date.strftime("%d/%m/%Y %H:%M:%S"), now.strftime("%d/%m/%Y %H:%M:%S"),
+                                     client=client, stream=True)
+    r.raise_for_status()
+    return ingest_log_values(subdevices, iter_json_array(r))  # split the answer by deviceId
+
+
+def update_log_values_in_batches(subdevices: Iterable, batch_size: int,
+                                 client: SLVClient = None) -> Tuple[Dict[int, int], Dict[int, Exception]]:
+    """
+    Update all subdevices, batch_size of them per getDevicesLogValues call. SubDevices are batched by the date their
+    update starts from so that each call asks for a window close to what every SubDevice of the batch needs.
+    :param subdevices: SubDevice instances
+    :param batch_size: number of SubDevices per call
+    :param client: SLVClient to use, defaults to the shared client
+    :return: dict {device_id: number of events added} and dict {device_id: error} of the failed batches
+    """
+    now = timezone.now()
+    subdevices = sorted(subdevices, key=lambda subdevice: fetch_from(subdevice, now))
+    added = {}
+    errors = {}
+    for start in range(0, len(subdevices), batch_size):
+        batch = subdevices[start:start + batch_size]
+        try:
+            added.update(update_log_values_batch(batch, client))
+        except (requests.RequestException, ValueError, KeyError, OSError) as error_caught:  # go on with other batches
+            errors.update({subdevice.device_id: error_caught for subdevice in batch})
+    return added, errors
+
+
+def backfill_subdevice(subdevice, from_date: datetime, to_date: datetime, chunk: str = 'week',
+                       client: SLVClient = None) -> Tuple[int, list]:
+    """
+    Ingest all log values of subdevice between from_date and to_date, fetched in chunks.
+    :param subdevice: SubDevice instance
+    :param from_date: start of the backfill
+    :param to_date: end of the backfill
+    :param chunk: 'day', 'week' or 'month'
+    :param client: SLVClient to use, defaults to the shared client
+    :return: the number of events added and the list of (start, end) chunks which could not be fetched
+    """
+    client = client or get_client(SLV_URL, logi, **SLV_CLIENT_OPTIONS)
+    device_ids, names = log_value_pairs([subdevice])
+    if not device_ids:
+        return 0, []
+    return backfill_log_values(SLV_URL, logi, IndexedHistory(subdevice), device_ids, names, from_date, to_date,
+                               chunk, max_workers=LOG_VALUES_BACKFILL_WORKERS, client=client)
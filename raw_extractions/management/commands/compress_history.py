@@ -0,0 +1,41 @@
+from os import path, walk
+
+from django.core.management.base import BaseCommand
+
+from api_management.file_writing import COMPRESSIONS, read_json_file, write_to_json_file
+from api_management.history_store import MANIFEST_NAME
+from raw_extractions.models import SubDevice
+from settings import FILE_PATH_FIELD, HISTORY_COMPRESSION
+
+
+def directory_size(directory: str) -> int:
+    """bytes of the files under directory"""
+    return sum(path.getsize(path.join(root, file_name))
+               for root, directories, file_names in walk(directory) for file_name in file_names)
+
+
+class Command(BaseCommand):
+    help = ("Compress the past months of every SubDevice history and the json files of log values under "
+            "FILE_PATH_FIELD. Files already compressed are left as they are, so it can be run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default=HISTORY_COMPRESSION or 'gzip',
+                            help='gzip is faster, lzma gives smaller files')
+
+    def handle(self, *args, **options):
+        compression = options['compression']
+        size_before = directory_size(FILE_PATH_FIELD)
+        segments = 0
+        for subdevice in SubDevice.objects.all():
+            if path.isdir(subdevice.device_value_history):
+                segments += subdevice.history_store().compress_closed_segments(compression)
+        json_files = 0
+        for root, directories, file_names in walk(FILE_PATH_FIELD):
+            for file_name in file_names:
+                if file_name.endswith('.json') and file_name != MANIFEST_NAME:
+                    file_path = path.join(root, file_name[:-len('.json')])
+                    write_to_json_file(file_path, read_json_file(file_path), compression)
+                    json_files += 1
+        size_after = directory_size(FILE_PATH_FIELD)
+        self.stdout.write("{} history segments and {} json files compressed with {}: {:.1f} MB -> {:.1f} MB".format(
+            segments, json_files, compression, size_before / 1e6, size_after / 1e6))
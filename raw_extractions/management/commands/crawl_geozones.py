@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api_management.geozones import crawl_geozones
+from settings import SLV_URL, logi, GEOZONE_ROOT_ID, GEOZONE_TREE_FILE
+
+
+class Command(BaseCommand):
+    help = "Crawl the geozone tree of SLV breadth-first and save it, to be loaded with GeozoneTree.load"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', type=int, default=GEOZONE_ROOT_ID, help='ID of the geozone to start from')
+        parser.add_argument('--output', default=GEOZONE_TREE_FILE,
+                            help="file the tree is written to, without its '.json' extension")
+        parser.add_argument('--max-workers', type=int, default=8,
+                            help='number of getGeozoneChildrenGeozones calls in flight')
+
+    def handle(self, *args, **options):
+        if options['root'] is None:
+            raise CommandError("no root geozone: give --root or set GEOZONE_ROOT_ID")
+        tree, errors = crawl_geozones(SLV_URL, logi, options['root'], options['max_workers'])
+        tree.save(options['output'])
+        self.stdout.write("{} geozones saved to {}".format(len(tree.geozones), options['output']))
+        for geozone_id, error_caught in errors.items():
+            self.stderr.write("children of geozone {} could not be read, its subtree is missing: {}".format(
+                geozone_id, error_caught))
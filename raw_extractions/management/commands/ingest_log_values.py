@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api_management.backfill import CHUNK_LENGTHS
+from raw_extractions.ingestion import update_log_values_in_batches, backfill_subdevice
+from raw_extractions.models import SubDevice
+from settings import LOG_VALUES_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Fetch the new log values of all SubDevices from SLV, several SubDevices per call, into their history store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=LOG_VALUES_BATCH_SIZE,
+                            help='number of SubDevices per getDevicesLogValues call')
+        parser.add_argument('--backfill-from', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                            help='instead of an update, backfill every SubDevice from this date (YYYY-MM-DD) to now')
+        parser.add_argument('--chunk', choices=sorted(CHUNK_LENGTHS), default='week',
+                            help='length of the chunks fetched in parallel during a backfill')
+
+    def handle(self, *args, **options):
+        subdevices = SubDevice.objects.select_related('device_name').prefetch_related('energy_names')
+        if options['backfill_from']:
+            from_date = timezone.make_aware(options['backfill_from'], timezone.utc)
+            for subdevice in subdevices:
+                added, failed_chunks = backfill_subdevice(subdevice, from_date, timezone.now(), options['chunk'])
+                self.stdout.write("{} events added for SubDevice {}".format(added, subdevice.device_id))
+                for start, end in failed_chunks:
+                    self.stderr.write("SubDevice {} could not be backfilled from {} to {}".format(
+                        subdevice.device_id, start, end))
+            return
+        added, errors = update_log_values_in_batches(list(subdevices), options['batch_size'])
+        self.stdout.write("{} events added for {} SubDevices".format(sum(added.values()), len(added)))
+        for device_id, error_caught in errors.items():
+            self.stderr.write("SubDevice {} could not be updated: {}".format(device_id, error_caught))
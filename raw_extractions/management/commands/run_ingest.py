@@ -0,0 +1,29 @@
+import logging
+import signal
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from raw_extractions.scheduler import IngestScheduler
+from settings import INGEST_INTERVAL, INGEST_WORKERS, INGEST_RETRY_DELAY, INGEST_MAX_RETRY_DELAY
+
+
+class Command(BaseCommand):
+    help = ("Update the log values of every SubDevice once per interval, the updates being spread over the interval, "
+            "until SIGINT or SIGTERM. Running updates are finished before leaving.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=INGEST_INTERVAL.total_seconds() / 60,
+                            help='minutes between two updates of a SubDevice')
+        parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help='updates running at the same time')
+
+    def handle(self, *args, **options):
+        if not logging.getLogger().handlers:  # no LOGGING configured: show the scheduler log on stderr
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        scheduler = IngestScheduler(timedelta(minutes=options['interval']), options['workers'], INGEST_RETRY_DELAY,
+                                    INGEST_MAX_RETRY_DELAY)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda signal_number, frame: scheduler.stop())
+        scheduler.run()
+        self.stdout.write("{} updates, {} failures, {} events added".format(
+            scheduler.stats['updates'], scheduler.stats['failures'], scheduler.stats['events']))
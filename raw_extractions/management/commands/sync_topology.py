@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api_management.api_calls import call_SLV_getAllControllers, crawl_controller_devices
+from api_management.json_stream import iter_json_array
+from api_management.slv_client import get_client
+from raw_extractions.forms import controller_choices_cache
+from raw_extractions.topology import sync_topology
+from settings import SLV_URL, logi, SLV_CLIENT_OPTIONS
+
+
+class Command(BaseCommand):
+    help = "Create and update Devices, SubDevices and ControllerTypes from the controllers and devices of SLV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-workers', type=int, default=8,
+                            help='number of getControllerDevices calls in flight')
+        parser.add_argument('--dry-run', action='store_true', help='show the changes without saving them')
+
+    def handle(self, *args, **options):
+        client = get_client(SLV_URL, logi, **SLV_CLIENT_OPTIONS)
+        r = call_SLV_getAllControllers(SLV_URL, logi, 'json', client=client, stream=True, refresh=True)
+        if r.status_code != 200:
+            raise CommandError("getAllControllers answered {}".format(r.status_code))
+        controllers = [elt['controllerDevice'] for elt in iter_json_array(r)]
+        devices, errors = crawl_controller_devices(SLV_URL, logi, [controller['controllerStrId']
+                                                                   for controller in controllers],
+                                                   options['max_workers'], client=client, refresh=True)
+        with transaction.atomic():
+            summary = sync_topology(controllers, devices)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+        controller_choices_cache.clear()
+        self.stdout.write("{} Devices created, {} updated. {} SubDevices created, {} updated.{}".format(
+            summary['devices_created'], summary['devices_updated'], summary['subdevices_created'],
+            summary['subdevices_updated'], " (dry run, nothing saved)" if options['dry_run'] else ""))
+        for device_str in summary['devices_missing']:
+            self.stderr.write("Device {} is no longer known by SLV".format(device_str))
+        for device_str, name in summary['name_conflicts'].items():
+            self.stderr.write("the SLV name of Device {} is used by another Device, it is named {}".format(
+                device_str, name))
+        for controller, error_caught in errors.items():
+            self.stderr.write("devices of controller {} could not be read: {}".format(controller, error_caught))
@@ -0,0 +1,120 @@
+"""
+ServerTimingMiddleware: where the time of each request goes.
+
+For each request it records the SLV calls (time and bytes), the database queries (count and time), the decoding of
+SLV JSON answers and the rendering of templates, and sends them in a Server-Timing header, which browser developer
+tools show next to the request. Requests longer than SLOW_REQUEST_SECONDS are logged, a share SLOW_REQUEST_LOG_RATE
+of them, on the 'raw_extractions.requests' logger.
+
+A staff user can get a cProfile report of one request instead of its page by sending the PROFILE_HEADER header.
+
+It is enabled by SERVER_TIMING. Only what runs in the thread of the request is counted, and the body of a streamed
+answer is produced after the header is sent, so its time is not counted.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+from django.template.backends import django as django_backend
+
+from api_management.metrics import RequestTimings, start_request_timings, stop_request_timings, timing
+from settings import SERVER_TIMING, SLOW_REQUEST_SECONDS, SLOW_REQUEST_LOG_RATE, PROFILE_HEADER, PROFILE_STATS_LINES
+
+logger = logging.getLogger('raw_extractions.requests')
+
+TIMING_PARTS = ('slv', 'db', 'json', 'template')  # in the order of the Server-Timing header
+
+
+def time_query(execute, sql, params, many, context):
+    """connection.execute_wrapper adding each query to the 'db' timing"""
+    with timing('db'):
+        return execute(sql, params, many, context)
+
+
+def instrument_templates():
+    """
+    add the rendering of every template to the 'template' timing, once per process. Templates rendered while another
+    one is, such as form widgets, are part of its time.
+    """
+    template_class = django_backend.Template
+    if getattr(template_class.render, 'timed', False):
+        return
+    render = template_class.render
+    rendering = threading.local()
+
+    def timed_render(self, context=None, request=None):
+        if getattr(rendering, 'active', False):
+            return render(self, context, request)
+        rendering.active = True
+        try:
+            with timing('template'):
+                return render(self, context, request)
+        finally:
+            rendering.active = False
+
+    timed_render.timed = True
+    template_class.render = timed_render
+
+
+def server_timing(timings: RequestTimings, total: float) -> str:
+    """the Server-Timing header value, durations in milliseconds"""
+    metrics = []
+    for part in TIMING_PARTS:
+        if part in timings.counts:
+            description = '{} calls'.format(timings.counts[part])
+            if timings.sizes[part]:
+                description += ', {} B'.format(timings.sizes[part])
+            metrics.append('{};dur={:.1f};desc="{}"'.format(part, timings.durations[part] * 1000, description))
+    metrics.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(metrics)
+
+
+def profile_report(profiler: cProfile.Profile) -> HttpResponse:
+    """the PROFILE_STATS_LINES functions with the most cumulative time, as a text answer"""
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+    return HttpResponse(output.getvalue(), content_type='text/plain; charset=utf-8')
+
+
+class ServerTimingMiddleware:
+    """Server-Timing header, sampled slow-request log and cProfile reports. Put it after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        if not SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        profiler = None
+        if request.headers.get(PROFILE_HEADER) and request.user.is_staff:
+            profiler = cProfile.Profile()
+        timings = start_request_timings()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(time_query):
+                if profiler is None:
+                    response = self.get_response(request)
+                else:
+                    response = profiler.runcall(self.get_response, request)
+        finally:
+            stop_request_timings()
+        total = time.perf_counter() - started
+        if profiler is not None:
+            response = profile_report(profiler)
+        response['Server-Timing'] = server_timing(timings, total)
+        if total >= SLOW_REQUEST_SECONDS and random.random() < SLOW_REQUEST_LOG_RATE:
+            logger.warning('slow_request path=%s status=%s total=%.3f %s', request.path, response.status_code, total,
+                           ' '.join('{0}={1:.3f} {0}_count={2}'.format(part, timings.durations[part],
+                                                                       timings.counts[part])
+                                    for part in TIMING_PARTS if part in timings.counts),
+                           extra={'path': request.path, 'total': total, 'timings': dict(timings.durations)})
+        return response
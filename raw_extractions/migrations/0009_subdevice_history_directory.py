@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raw_extractions', '0008_subdevice_device_value_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subdevice',
+            name='device_value_history',
+            field=models.FilePathField(allow_files=False, allow_folders=True, path='log_values\\', verbose_name='Value_storage_file'),
+        ),
+    ]
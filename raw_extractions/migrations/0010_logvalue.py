@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raw_extractions', '0009_subdevice_history_directory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_time', models.DateTimeField(verbose_name='Event Time')),
+                ('value', models.FloatField(null=True, verbose_name='Value')),
+                ('energy_name', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='raw_extractions.EnergyName', verbose_name='Energy Name')),
+                ('subdevice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='raw_extractions.SubDevice', verbose_name='SubDevice')),
+            ],
+            options={
+                'unique_together': {('subdevice', 'energy_name', 'event_time')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raw_extractions', '0010_logvalue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnergyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4, verbose_name='Period')),
+                ('period_start', models.DateTimeField(verbose_name='Period Start')),
+                ('kwh', models.FloatField(verbose_name='kWh')),
+                ('subdevice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='raw_extractions.SubDevice', verbose_name='SubDevice')),
+            ],
+            options={
+                'unique_together': {('subdevice', 'period', 'period_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('raw_extractions', '0011_energyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwitchingDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('burn_hours', models.FloatField(verbose_name='Burn Hours')),
+                ('switch_on', models.DateTimeField(null=True, verbose_name='First Switch On')),
+                ('switch_off', models.DateTimeField(null=True, verbose_name='Last Switch Off')),
+                ('intervals', models.TextField(default='[]', verbose_name='On Intervals')),
+                ('subdevice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='raw_extractions.SubDevice', verbose_name='SubDevice')),
+            ],
+            options={
+                'unique_together': {('subdevice', 'day')},
+            },
+        ),
+    ]
@@ -1,7 +1,6 @@
 from django.db import models
-from django.utils import timezone
-from api_management.api_calls import call_SLV_getDevicesLogValues, historize_log_values
-from settings import SLV_URL, logi, FILE_PATH_FIELD
+from api_management.history_store import HistoryStore
+from settings import FILE_PATH_FIELD, HISTORY_COMPRESSION
 
 
 class ControllerType(models.Model):
@@ -24,23 +23,71 @@ class SubDevice(models.Model):
     device_name = models.ForeignKey('Device', verbose_name='Device Name', on_delete='PROTECT')
     energy_names = models.ManyToManyField('EnergyName', verbose_name='Energy Name')
     category = models.ForeignKey('ControllerType', on_delete='PROTECT', verbose_name='Category')
-    device_value_history = models.FilePathField(path=FILE_PATH_FIELD + device_name.device_str + device_id.__str__(),
+    device_value_history = models.FilePathField(path=FILE_PATH_FIELD, allow_files=False, allow_folders=True,
                                                 verbose_name="Value_storage_file")
 
     def __str__(self):
         return self.device_name.device_str + self.category.category
 
+    def history_store(self, read_only: bool = False) -> HistoryStore:
+        """
+        the store holding all log values of SubDevice, in the device_value_history directory
+        :param read_only: True when only reading it, e.g. from a view
+        """
+        return HistoryStore(self.device_value_history, read_only=read_only, compression=HISTORY_COMPRESSION)
+
     def update_log_values(self):
         """
-        updates the file containing all log values of SubDevice
+        appends the new log values of SubDevice to its history store and LogValue table. Only values from the oldest
+        energy name watermark (minus LOG_VALUES_OVERLAP) are asked to SLV, or the last LOG_VALUES_BACKFILL if an energy
+        name has none yet.
         :return: None
         """
-        result = call_SLV_getDevicesLogValues(SLV_URL, logi, 'json', self.device_id,
-                                     self.energy_names.all().values_list('name', flat=True),
-                                     (timezone.now() - timezone.timedelta(days=15)).strftime("%d/%m/%Y %H:%M:%S"),
-                                     timezone.now().strftime("%d/%m/%Y %H:%M:%S"),
-                                     self.device_value_history)
-        historize_log_values(self.device_value_history, result.json())
+        from .ingestion import update_log_values_batch  # ingestion needs the models
+        update_log_values_batch([self])
+
+
+class LogValue(models.Model):
+    subdevice = models.ForeignKey('SubDevice', verbose_name='SubDevice', on_delete=models.CASCADE)
+    energy_name = models.ForeignKey('EnergyName', verbose_name='Energy Name', on_delete=models.PROTECT)
+    event_time = models.DateTimeField(verbose_name='Event Time')
+    value = models.FloatField(null=True, verbose_name='Value')
+
+    class Meta:
+        # also the index used by range queries on (subdevice, energy_name, event_time)
+        unique_together = ('subdevice', 'energy_name', 'event_time')
+
+    def __str__(self):
+        return "{} {} {}".format(self.subdevice, self.energy_name, self.event_time)
+
+
+class EnergyRollup(models.Model):
+    PERIODS = (('hour', 'Hour'), ('day', 'Day'))
+    subdevice = models.ForeignKey('SubDevice', verbose_name='SubDevice', on_delete=models.CASCADE)
+    period = models.CharField(max_length=4, choices=PERIODS, verbose_name='Period')
+    period_start = models.DateTimeField(verbose_name='Period Start')
+    kwh = models.FloatField(verbose_name='kWh')
+
+    class Meta:
+        unique_together = ('subdevice', 'period', 'period_start')
+
+    def __str__(self):
+        return "{} {} {}".format(self.subdevice, self.period, self.period_start)
+
+
+class SwitchingDay(models.Model):
+    subdevice = models.ForeignKey('SubDevice', verbose_name='SubDevice', on_delete=models.CASCADE)
+    day = models.DateField(verbose_name='Day')
+    burn_hours = models.FloatField(verbose_name='Burn Hours')
+    switch_on = models.DateTimeField(null=True, verbose_name='First Switch On')
+    switch_off = models.DateTimeField(null=True, verbose_name='Last Switch Off')
+    intervals = models.TextField(default='[]', verbose_name='On Intervals')  # json list of [on, off] eventTimes
+
+    class Meta:
+        unique_together = ('subdevice', 'day')
+
+    def __str__(self):
+        return "{} {}".format(self.subdevice, self.day)
 
 
 class Device(models.Model):
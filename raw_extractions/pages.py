@@ -0,0 +1,98 @@
+"""
+Pages and overview of the log values shown by raw_data_present.
+
+Pages use keyset pagination on eventTime: a page is the RAW_DATA_PAGE_SIZE events after the eventTime of the last
+event of the previous page, found with the LogValue index or with a bisection of the sorted SLV answer, so a page
+costs the same whatever the range. The overview gives the min, max and average value per hour, day or month, the
+bucket being chosen so that there are at most RAW_DATA_OVERVIEW_BUCKETS of them.
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+from django.db.models import Min, Max, Avg, Count, QuerySet
+from django.db.models.functions import Trunc
+
+from settings import RAW_DATA_OVERVIEW_BUCKETS
+from .ingestion import parse_event_time, parse_value
+
+BUCKETS = (('hour', 3600, 'h'), ('day', 86400, 'D'), ('month', 31 * 86400, 'M'))  # kind, longest, NumPy unit
+BUCKET_FORMATS = {'hour': "%Y-%m-%d %H:00", 'day': "%Y-%m-%d", 'month': "%Y-%m"}
+
+
+def overview_bucket(start: datetime, end: datetime) -> str:
+    """the finest of 'hour', 'day' and 'month' giving at most RAW_DATA_OVERVIEW_BUCKETS buckets from start to end"""
+    for kind, seconds, unit in BUCKETS:
+        if (end - start).total_seconds() / seconds <= RAW_DATA_OVERVIEW_BUCKETS:
+            return kind
+    return 'month'
+
+
+def log_value_page(log_values: QuerySet, deviceId: int, name: str, after: Optional[str],
+                   size: int) -> Tuple[list, Optional[str]]:
+    """
+    :param log_values: LogValue rows of one SubDevice and energy name, in the range shown
+    :param deviceId: device ID put in the events
+    :param name: log value name put in the events
+    :param after: eventTime of the last event of the previous page, None for the first page
+    :param size: number of events per page
+    :return: the events of the page as returned by getDevicesLogValues, and the cursor of the next page (None if this
+    is the last one)
+    """
+    if after is not None:
+        log_values = log_values.filter(event_time__gt=parse_event_time(after))
+    rows = list(log_values.order_by('event_time').values_list('event_time', 'value')[:size + 1])
+    events = [{'deviceId': deviceId, 'name': name, 'eventTime': event_time.strftime("%Y-%m-%d %H:%M:%S"),
+               'value': value} for event_time, value in rows[:size]]
+    return events, (events[-1]['eventTime'] if len(rows) > size else None)
+
+
+def events_page(events: list, event_times: list, after: Optional[str], size: int) -> Tuple[list, Optional[str]]:
+    """
+    :param events: log values sorted by eventTime
+    :param event_times: eventTime of each event
+    :param after: eventTime of the last event of the previous page, None for the first page
+    :param size: number of events per page
+    :return: the events of the page and the cursor of the next page, None if this is the last one
+    """
+    first = 0 if after is None else bisect_right(event_times, after)
+    page = events[first:first + size]
+    return page, (page[-1]['eventTime'] if first + size < len(events) else None)
+
+
+def log_value_overview(log_values: QuerySet, kind: str) -> list:
+    """
+    :param log_values: LogValue rows of one SubDevice and energy name, in the range shown
+    :param kind: 'hour', 'day' or 'month'
+    :return: list of {'bucket', 'min', 'max', 'avg', 'count'} dicts, aggregated by the database
+    """
+    buckets = log_values.filter(value__isnull=False).annotate(bucket=Trunc('event_time', kind)).values(
+        'bucket').annotate(min=Min('value'), max=Max('value'), avg=Avg('value'), count=Count('pk')).order_by('bucket')
+    return [dict(bucket, bucket=bucket['bucket'].strftime(BUCKET_FORMATS[kind])) for bucket in buckets]
+
+
+def events_overview(events: list, kind: str) -> list:
+    """
+    :param events: log values sorted by eventTime
+    :param kind: 'hour', 'day' or 'month'
+    :return: list of {'bucket', 'min', 'max', 'avg', 'count'} dicts of the numeric values
+    """
+    samples = [(event['eventTime'], parse_value(event.get('value'))) for event in events]
+    samples = [(event_time, value) for event_time, value in samples if value is not None]
+    if not samples:
+        return []
+    unit = {bucket_kind: bucket_unit for bucket_kind, seconds, bucket_unit in BUCKETS}[kind]
+    times = np.array([event_time for event_time, value in samples], dtype='datetime64[s]')
+    values = np.array([value for event_time, value in samples], dtype=float)
+    buckets = times.astype('datetime64[{}]'.format(unit))
+    firsts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))  # first sample of each bucket
+    counts = np.diff(np.concatenate((firsts, [len(values)])))
+    minimums = np.minimum.reduceat(values, firsts).tolist()
+    maximums = np.maximum.reduceat(values, firsts).tolist()
+    averages = (np.add.reduceat(values, firsts) / counts).tolist()
+    return [{'bucket': bucket.strftime(BUCKET_FORMATS[kind]), 'min': minimum, 'max': maximum, 'avg': average,
+             'count': count}
+            for bucket, minimum, maximum, average, count in zip(buckets[firsts].astype(datetime), minimums, maximums,
+                                                                 averages, counts.tolist())]
@@ -0,0 +1,112 @@
+"""
+Hourly and daily energy consumption of each SubDevice, computed from its TotalKWHPositive counter.
+
+The counter is turned into a cumulative consumption with NumPy: a drop of the counter is a reset, the consumption
+since the reset being the new index. The cumulative consumption is then interpolated at every hour boundary, so a gap
+between two samples is spread evenly over the hours it covers. Days are the sum of their 24 hours.
+
+After each ingestion only the days touched by the new values, from the sample before them to the sample after them,
+are computed again and stored in EnergyRollup.
+"""
+
+from datetime import datetime
+from typing import Dict, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from settings import ROLLUP_ENERGY_NAME
+from .models import LogValue, EnergyRollup
+
+HOUR = 3600  # seconds
+DAY = 24 * HOUR
+
+
+def to_datetime(epoch_seconds: float) -> datetime:
+    """the aware UTC datetime of epoch seconds"""
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc)
+
+
+def consumption_per_bucket(times: np.ndarray, values: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """
+    :param times: epoch seconds of the counter samples, increasing
+    :param values: counter index of each sample
+    :param boundaries: epoch seconds of the bucket limits, increasing
+    :return: energy consumed in each bucket, one less element than boundaries
+    """
+    deltas = np.diff(values)
+    deltas = np.where(deltas < 0, values[1:], deltas)  # after a reset the counter counted up again from 0
+    consumed = np.concatenate(([0.], np.cumsum(deltas)))
+    return np.diff(np.interp(boundaries, times, consumed))
+
+
+def samples_around(subdevice_pk: int, energy_name_pk: int, start: datetime, end: datetime) -> tuple:
+    """
+    :return: epoch seconds and values of the samples between start and end, plus the samples just around them so
+    that the consumption up to the limits can be interpolated
+    """
+    log_values = LogValue.objects.filter(subdevice_id=subdevice_pk, energy_name_id=energy_name_pk,
+                                         value__isnull=False)
+    rows = list(log_values.filter(event_time__lt=start).order_by('-event_time').values_list('event_time', 'value')[:1])
+    rows += log_values.filter(event_time__gte=start, event_time__lt=end).order_by('event_time').values_list(
+        'event_time', 'value')
+    rows += log_values.filter(event_time__gte=end).order_by('event_time').values_list('event_time', 'value')[:1]
+    times = np.fromiter((event_time.timestamp() for event_time, value in rows), dtype=float, count=len(rows))
+    values = np.fromiter((value for event_time, value in rows), dtype=float, count=len(rows))
+    return times, values
+
+
+def neighbours(subdevice_pk: int, energy_name_pk: int, first: datetime, last: datetime) -> Tuple[datetime, datetime]:
+    """
+    :return: times of the samples just before first and just after last, first and last themselves if there are none.
+    New values from first to last change what is interpolated between them.
+    """
+    log_values = LogValue.objects.filter(subdevice_id=subdevice_pk, energy_name_id=energy_name_pk,
+                                         value__isnull=False)
+    previous = log_values.filter(event_time__lt=first).order_by('-event_time').values_list('event_time',
+                                                                                        flat=True).first()
+    following = log_values.filter(event_time__gt=last).order_by('event_time').values_list('event_time',
+                                                                                       flat=True).first()
+    return previous or first, following or last
+
+
+def update_energy_rollups(subdevice_pk: int, energy_name_pk: int, first: datetime, last: datetime):
+    """
+    Compute again the hourly and daily consumption of the days from the sample before first to the sample after last
+    included, as the consumption between two samples is spread over the hours between them.
+    :param subdevice_pk: primary key of the SubDevice
+    :param energy_name_pk: primary key of its counter EnergyName
+    :param first: time of the oldest new value
+    :param last: time of the most recent new value
+    """
+    first, last = neighbours(subdevice_pk, energy_name_pk, first, last)
+    start = int(first.timestamp()) // DAY * DAY
+    end = (int(last.timestamp()) // DAY + 1) * DAY
+    times, values = samples_around(subdevice_pk, energy_name_pk, to_datetime(start), to_datetime(end))
+    if len(times) < 2:
+        return
+    hours = np.arange(start, end + 1, HOUR, dtype=float)
+    hourly = consumption_per_bucket(times, values, hours)
+    daily = hourly.reshape(-1, 24).sum(axis=1)
+    covered = (hours[1:] > times[0]) & (hours[:-1] < times[-1])  # hours with samples around them
+    covered_days = covered.reshape(-1, 24).any(axis=1)
+    rollups = [EnergyRollup(subdevice_id=subdevice_pk, period='hour', period_start=to_datetime(hours[i]),
+                            kwh=hourly[i]) for i in np.flatnonzero(covered)]
+    rollups += [EnergyRollup(subdevice_id=subdevice_pk, period='day', period_start=to_datetime(start + i * DAY),
+                             kwh=daily[i]) for i in np.flatnonzero(covered_days)]
+    with transaction.atomic():
+        EnergyRollup.objects.filter(subdevice_id=subdevice_pk, period_start__gte=to_datetime(start),
+                                    period_start__lt=to_datetime(end)).delete()
+        EnergyRollup.objects.bulk_create(rollups)
+
+
+def update_rollups(touched: Dict[Tuple[int, str], Tuple[datetime, datetime]], energy_name_pks: Dict[str, int]):
+    """
+    Update the rollups of the days touched by an ingestion.
+    :param touched: {(subdevice_pk, energy name): (first, last)} times of the values ingested
+    :param energy_name_pks: {energy name: primary key}
+    """
+    for (subdevice_pk, name), (first, last) in touched.items():
+        if name == ROLLUP_ENERGY_NAME:
+            update_energy_rollups(subdevice_pk, energy_name_pks[name], first, last)
@@ -0,0 +1,155 @@
+"""
+In-process scheduler of the log value updates, run by manage.py run_ingest.
+
+Each SubDevice has its own job in a priority queue ordered by due time. The jobs of the SubDevices are spread evenly
+over the interval, so that SLV and the database see a steady flow of small updates instead of all of them at once, and
+at most max_workers run at the same time. A job which fails is retried after a delay doubled at each consecutive
+failure of its SubDevice, up to max_retry_delay. The list of SubDevices is read again every interval: new ones are
+spread over the next interval, deleted ones are dropped.
+
+stop() lets the running jobs finish and starts no other, it is what SIGINT and SIGTERM call in run_ingest.
+"""
+
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections
+
+from .ingestion import update_log_values_batch
+from .models import SubDevice
+
+logger = logging.getLogger('raw_extractions.scheduler')
+
+REFRESH = None  # job reading the list of SubDevices again, instead of a SubDevice primary key
+
+
+def update_subdevice(subdevice_pk: int) -> int:
+    """
+    update one SubDevice, in a worker thread
+    :return: the number of events added
+    """
+    close_old_connections()
+    try:
+        subdevice = SubDevice.objects.prefetch_related('energy_names').get(pk=subdevice_pk)
+        return sum(update_log_values_batch([subdevice]).values())
+    finally:
+        close_old_connections()  # each worker thread has its own connection
+
+
+class IngestScheduler:
+    """Runs the update of every SubDevice once per interval on a bounded thread pool"""
+
+    def __init__(self, interval: timedelta, max_workers: int, retry_delay: timedelta, max_retry_delay: timedelta):
+        """
+        :param interval: time between two updates of a SubDevice
+        :param max_workers: updates running at the same time
+        :param retry_delay: wait after a first failure
+        :param max_retry_delay: longest wait after consecutive failures
+        """
+        self.interval = interval.total_seconds()
+        self.max_workers = max_workers
+        self.retry_delay = retry_delay.total_seconds()
+        self.max_retry_delay = max_retry_delay.total_seconds()
+        self.jobs = []  # heap of (due time, sequence number, SubDevice primary key or REFRESH)
+        self._sequence = itertools.count()  # orders jobs due at the same time
+        self.subdevice_pks = set()  # SubDevices to update
+        self.scheduled = set()  # SubDevices with a job in the heap or running
+        self.failures = {}  # consecutive failures of each SubDevice
+        self.running = {}  # Future -> (SubDevice primary key, due time)
+        self.results = queue.Queue()  # Futures done, put by the worker threads
+        self.stats = {'updates': 0, 'failures': 0, 'events': 0}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """finish the running updates and return from run, safe to call from a signal handler"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def push(self, due: float, subdevice_pk):
+        heapq.heappush(self.jobs, (due, next(self._sequence), subdevice_pk))
+        if subdevice_pk is not REFRESH:
+            self.scheduled.add(subdevice_pk)
+
+    def refresh(self, now: float):
+        """read the SubDevices to update, spread the new ones over the next interval and plan the next refresh"""
+        self.subdevice_pks = set(SubDevice.objects.filter(energy_names__isnull=False).values_list('pk', flat=True))
+        new_pks = sorted(self.subdevice_pks - self.scheduled)
+        for i, subdevice_pk in enumerate(new_pks):
+            self.push(now + self.interval * i / len(new_pks), subdevice_pk)
+        for subdevice_pk in set(self.failures) - self.subdevice_pks:
+            del self.failures[subdevice_pk]
+        self.push(now + self.interval, REFRESH)
+        logger.info('ingest_refresh subdevices=%d new=%d', len(self.subdevice_pks), len(new_pks))
+
+    def retry_wait(self, failures: int) -> float:
+        """seconds before the next try after failures consecutive failures, with jitter so retries do not bunch"""
+        return min(self.max_retry_delay, self.retry_delay * 2 ** (failures - 1)) * random.uniform(0.75, 1.)
+
+    def finish(self, future: Future, now: float):
+        """plan the next update of the SubDevice of a finished job"""
+        subdevice_pk, due = self.running.pop(future)
+        error = future.exception()
+        if error is None:
+            self.failures.pop(subdevice_pk, None)
+            self.stats['updates'] += 1
+            self.stats['events'] += future.result()
+            next_due = max(due + self.interval, now)  # keeps its place in the interval unless it ran late
+        else:
+            failures = self.failures.get(subdevice_pk, 0) + 1
+            self.failures[subdevice_pk] = failures
+            self.stats['failures'] += 1
+            next_due = now + self.retry_wait(failures)
+            logger.warning('ingest_failed subdevice=%s failures=%d retry_in=%.0f error=%r', subdevice_pk, failures,
+                           next_due - now, error)
+        self.scheduled.discard(subdevice_pk)
+        if subdevice_pk in self.subdevice_pks and not self._stopping.is_set():
+            self.push(next_due, subdevice_pk)
+
+    def collect(self):
+        """plan the next update of every job done since the last call"""
+        while True:
+            try:
+                future = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.finish(future, time.monotonic())
+
+    def on_done(self, future: Future):
+        self.results.put(future)
+        self._wakeup.set()
+
+    def run(self):
+        """update the SubDevices until stop is called"""
+        self.refresh(time.monotonic())
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix='ingest') as executor:
+            while not self._stopping.is_set():
+                self.collect()
+                now = time.monotonic()
+                while self.jobs and self.jobs[0][0] <= now and len(self.running) < self.max_workers:
+                    due, sequence, subdevice_pk = heapq.heappop(self.jobs)
+                    if subdevice_pk is REFRESH:
+                        self.refresh(now)
+                    elif subdevice_pk not in self.subdevice_pks:  # deleted since it was planned
+                        self.scheduled.discard(subdevice_pk)
+                    else:
+                        future = executor.submit(update_subdevice, subdevice_pk)
+                        self.running[future] = (subdevice_pk, due)
+                        future.add_done_callback(self.on_done)
+                if len(self.running) >= self.max_workers or not self.jobs:
+                    timeout = None  # until a job is done or stop is called
+                else:
+                    timeout = max(0., self.jobs[0][0] - now)
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+            logger.info('ingest_stopping running=%d', len(self.running))
+        self.collect()
+        logger.info('ingest_stopped updates=%d failures=%d events=%d', self.stats['updates'], self.stats['failures'],
+                    self.stats['events'])
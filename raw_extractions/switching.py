@@ -0,0 +1,136 @@
+"""
+Daily switch-on/switch-off times and burn hours of each SubDevice, computed from its DigitalOutput1 series.
+
+A DigitalOutput1 sample gives the state of the output until the next sample. The whole series is handled at once with
+NumPy: np.diff of the 0/1 states gives the switch-on and switch-off transitions, on intervals crossing midnight are
+cut at each day boundary with np.repeat, and the burn time of each day is summed with np.bincount.
+
+Results are stored in SwitchingDay, one row per SubDevice and day. After each ingestion only the days touched by the
+samples inserted, from the sample before them to the sample after them, are computed again.
+"""
+
+import json
+from datetime import datetime
+from typing import Dict, Tuple
+
+import numpy as np
+from django.db import transaction
+
+from settings import SWITCHING_ENERGY_NAME
+from .models import SwitchingDay
+from .rollups import DAY, HOUR, to_datetime, neighbours, samples_around
+
+
+def on_intervals(times: np.ndarray, states: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param times: epoch seconds of the samples, increasing
+    :param states: value of each sample, the output being on when it is above 0.5
+    :return: starts and ends of the on intervals, and for each of them whether its start is a switch-on and its end a
+    switch-off (False when the series begins or ends while on)
+    """
+    on = (states > 0.5).astype(np.int8)
+    transitions = np.diff(on)
+    starts = times[1:][transitions == 1]
+    ends = times[1:][transitions == -1]
+    real_starts = np.ones(len(starts), dtype=bool)
+    real_ends = np.ones(len(ends), dtype=bool)
+    if len(on) and on[0]:
+        starts = np.concatenate(([times[0]], starts))
+        real_starts = np.concatenate(([False], real_starts))
+    if len(on) and on[-1]:
+        ends = np.concatenate((ends, [times[-1]]))
+        real_ends = np.concatenate((real_ends, [False]))
+    return starts, ends, real_starts, real_ends
+
+
+def split_by_day(starts: np.ndarray, ends: np.ndarray, origin: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                              np.ndarray]:
+    """
+    Cut the intervals at each day boundary.
+    :param starts: interval starts in epoch seconds
+    :param ends: interval ends in epoch seconds
+    :param origin: epoch seconds of a midnight before every interval
+    :return: index of the day of each piece counted from origin, start and end of each piece, and the index of the
+    interval each piece comes from. Pieces are in time order.
+    """
+    first_days = ((starts - origin) // DAY).astype(int)
+    last_days = np.maximum(np.ceil((ends - origin) / DAY).astype(int) - 1, first_days)
+    pieces = last_days - first_days + 1
+    interval = np.repeat(np.arange(len(starts)), pieces)
+    rank = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)  # piece number in its interval
+    days = first_days[interval] + rank
+    piece_starts = np.maximum(starts[interval], origin + days * DAY)
+    piece_ends = np.minimum(ends[interval], origin + (days + 1) * DAY)
+    return days, piece_starts, piece_ends, interval
+
+
+def format_time(epoch_seconds: float) -> str:
+    """the SLV eventTime of epoch seconds"""
+    return to_datetime(epoch_seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def switching_days(subdevice_pk: int, times: np.ndarray, states: np.ndarray, start: int, end: int) -> list:
+    """
+    :param subdevice_pk: primary key of the SubDevice
+    :param times: epoch seconds of its DigitalOutput1 samples, increasing
+    :param states: value of each sample
+    :param start: epoch seconds of the first midnight computed
+    :param end: epoch seconds of the midnight after the last day computed
+    :return: unsaved SwitchingDay instances of the days from start to end which have samples around them
+    """
+    starts, ends, real_starts, real_ends = on_intervals(times, states)
+    days, piece_starts, piece_ends, interval = split_by_day(starts, ends, start)
+    count = (end - start) // DAY
+    inside = (days >= 0) & (days < count)
+    days, piece_starts, piece_ends, interval = days[inside], piece_starts[inside], piece_ends[inside], interval[inside]
+    burn_seconds = np.bincount(days, weights=piece_ends - piece_starts, minlength=count)
+    switch_ons = real_starts[interval] & (piece_starts == starts[interval])
+    switch_offs = real_ends[interval] & (piece_ends == ends[interval])
+    limits = np.searchsorted(days, np.arange(count + 1))  # pieces of day i are limits[i]:limits[i + 1]
+    midnights = start + np.arange(count + 1) * DAY
+    covered = (midnights[1:] > times[0]) & (midnights[:-1] < times[-1])  # days with samples around them
+    switching = []
+    for i in np.flatnonzero(covered):
+        day = slice(limits[i], limits[i + 1])
+        on_times = piece_starts[day][switch_ons[day]]
+        off_times = piece_ends[day][switch_offs[day]]
+        switching.append(SwitchingDay(
+            subdevice_id=subdevice_pk, day=to_datetime(midnights[i]).date(), burn_hours=burn_seconds[i] / HOUR,
+            switch_on=to_datetime(on_times[0]) if len(on_times) else None,
+            switch_off=to_datetime(off_times[-1]) if len(off_times) else None,
+            intervals=json.dumps([[format_time(on_time), format_time(off_time)]
+                                  for on_time, off_time in zip(piece_starts[day], piece_ends[day])])))
+    return switching
+
+
+def update_switching_days(subdevice_pk: int, energy_name_pk: int, first: datetime, last: datetime):
+    """
+    Compute again the switching of the days from the sample before first, whose state lasted until first, to the
+    sample after last included.
+    :param subdevice_pk: primary key of the SubDevice
+    :param energy_name_pk: primary key of its DigitalOutput1 EnergyName
+    :param first: time of the oldest new value
+    :param last: time of the most recent new value
+    """
+    first, last = neighbours(subdevice_pk, energy_name_pk, first, last)
+    start = int(first.timestamp()) // DAY * DAY
+    end = (int(last.timestamp()) // DAY + 1) * DAY
+    times, states = samples_around(subdevice_pk, energy_name_pk, to_datetime(start), to_datetime(end))
+    if len(times) < 2:
+        return
+    switching = switching_days(subdevice_pk, times, states, start, end)
+    with transaction.atomic():
+        SwitchingDay.objects.filter(subdevice_id=subdevice_pk, day__gte=to_datetime(start).date(),
+                                    day__lt=to_datetime(end).date()).delete()
+        SwitchingDay.objects.bulk_create(switching)
+
+
+def update_switching(touched: Dict[Tuple[int, str], Tuple[datetime, datetime]], energy_name_pks: Dict[str, int]):
+    """
+    Update the switching of the days touched by an ingestion.
+    :param touched: {(subdevice_pk, energy name): (first, last)} times of the values ingested
+    :param energy_name_pks: {energy name: primary key}
+    """
+    for (subdevice_pk, name), (first, last) in touched.items():
+        if name == SWITCHING_ENERGY_NAME:
+            update_switching_days(subdevice_pk, energy_name_pks[name], first, last)
@@ -1,3 +1,449 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from api_management.api_calls import call_SLV_getControllerDevices, crawl_controller_devices, historize_log_values
+from api_management.file_writing import COMPRESSIONS, json_file_name, read_json_file
+from api_management.fake_slv import FakeFleet, FakeSLVServer, ROOT_GEOZONE_ID
+from api_management.geozones import GeozoneTree, crawl_geozones
+from api_management.history_store import HistoryStore
+from api_management.json_stream import iter_json_array
+from api_management.limiter import AdaptiveLimiter
+from api_management.metrics import slv_metrics
+from api_management.slv_client import SLVClient, get_client
+from settings import HISTORY_COMPRESSION, SLV_CLIENT_OPTIONS, SLV_LIMITER_OPTIONS
+from .ingestion import fetch_from, ingest_log_values, update_log_values_in_batches
+from .models import ControllerType, Device, EnergyName, EnergyRollup, LogValue, SubDevice, SwitchingDay
+from .topology import sync_topology
+
+
+class SubDeviceTestCase(TestCase):
+    """an electric counter SubDevice whose history store is in a temporary directory, and a fake fleet for its events"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        category = ControllerType.objects.create(category='electricalCounter')
+        energy_name = EnergyName.objects.create(name='TotalKWHPositive', category=category)
+        device = Device.objects.create(device_str='CBC_FK_0000', device_name='Fake controller 0', device_group='1')
+        self.subdevice = SubDevice.objects.create(device_id=60000, device_name=device, category=category,
+                                                  device_value_history=os.path.join(self.directory, '60000'))
+        self.subdevice.energy_names.add(energy_name)
+        self.fleet = FakeFleet(1, history_days=7, end=datetime(2024, 3, 10))
+
+    def events(self, start: datetime, end: datetime) -> list:
+        return list(self.fleet.log_values(60000, 'TotalKWHPositive', start, end))
+
+
+class IngestionTests(SubDeviceTestCase):
+    def test_ingest_more_rows_than_one_insert_accepts(self):
+        events = self.events(self.fleet.start, self.fleet.end)
+        self.assertGreater(len(events), 1000)  # above the 500 rows of a SQLite INSERT
+        self.assertEqual(ingest_log_values([self.subdevice], events), {60000: len(events)})
+        self.assertEqual(LogValue.objects.filter(subdevice=self.subdevice).count(), len(events))
+        self.assertEqual(ingest_log_values([self.subdevice], events), {60000: 0})
+        self.assertEqual(LogValue.objects.filter(subdevice=self.subdevice).count(), len(events))
+
+    def test_failed_database_commit_leaves_the_store_alone(self):
+        atomic = transaction.atomic
+
+        @contextmanager
+        def locked_commit():
+            with atomic():
+                yield
+            raise OperationalError('database is locked')  # as if the commit had failed
+
+        def ingestion_atomic(*args, **kwargs):  # only the transaction of ingest_log_values itself fails
+            return atomic(*args, **kwargs) if args or kwargs else locked_commit()
+
+        with mock.patch.object(transaction, 'atomic', ingestion_atomic):
+            with self.assertRaises(OperationalError):
+                ingest_log_values([self.subdevice], self.events(self.fleet.start, self.fleet.end))
+        store = self.subdevice.history_store(read_only=True)
+        self.assertIsNone(store.watermark('TotalKWHPositive'))
+        self.assertEqual(list(store), [])
+
+    def test_fetch_from_leaves_a_running_writer_alone(self):
+        events = self.events(self.fleet.start, self.fleet.end)
+        with self.subdevice.history_store().writer() as writer:
+            for event in events:
+                writer.add(event)
+            fetch_from(self.subdevice, timezone.now())  # e.g. a batch update started meanwhile
+        self.assertEqual(list(self.subdevice.history_store(read_only=True)), events)
+
+    def test_update_in_batches_from_slv(self):
+        subdevices = [self.subdevice]
+        for device_id in (60002, 60004):
+            subdevice = SubDevice.objects.create(device_id=device_id, device_name=self.subdevice.device_name,
+                                                 category=self.subdevice.category,
+                                                 device_value_history=os.path.join(self.directory, str(device_id)))
+            subdevice.energy_names.set(self.subdevice.energy_names.all())
+            subdevices.append(subdevice)
+        with FakeSLVServer(FakeFleet(3, history_days=30)) as server:
+            client = SLVClient(server.url, ('test', 'test'), backoff_factor=0)
+            self.addCleanup(client.close)
+            added, errors = update_log_values_in_batches(subdevices, 2, client)
+            self.assertEqual(errors, {})
+            self.assertEqual(sorted(added), [60000, 60002, 60004])
+            for subdevice in subdevices:
+                stored = list(subdevice.history_store(read_only=True))
+                self.assertGreater(len(stored), 0)
+                self.assertEqual(added[subdevice.device_id], len(stored))
+                self.assertEqual(LogValue.objects.filter(subdevice=subdevice).count(), len(stored))
+            # the next update only asks for the overlap again, which the stores already hold
+            self.assertEqual(update_log_values_in_batches(subdevices, 2, client), ({60000: 0, 60002: 0, 60004: 0}, {}))
+
+
+def log_value(name: str, event_time: str, value) -> dict:
+    """a log value of SubDevice 60000 as returned by getDevicesLogValues"""
+    return {'deviceId': 60000, 'name': name, 'eventTime': event_time, 'value': value}
+
+
+class RollupTests(SubDeviceTestCase):
+    def hourly(self) -> dict:
+        return {rollup.period_start.strftime("%d %H"): rollup.kwh
+                for rollup in EnergyRollup.objects.filter(period='hour').order_by('period_start')}
+
+    def daily(self) -> dict:
+        return {rollup.period_start.strftime("%d"): rollup.kwh for rollup in EnergyRollup.objects.filter(period='day')}
+
+    def ingest(self, *samples):
+        ingest_log_values([self.subdevice], [log_value('TotalKWHPositive', event_time, value)
+                                             for event_time, value in samples])
+
+    def test_counter_reset(self):
+        self.ingest(('2024-03-01 00:00:00', 100), ('2024-03-01 01:00:00', 110), ('2024-03-01 02:00:00', 5),
+                    ('2024-03-01 03:00:00', 15))
+        self.assertEqual(self.hourly(), {'01 00': 10., '01 01': 5., '01 02': 10.})
+        self.assertEqual(self.daily(), {'01': 25.})
+
+    def test_gap_spread_over_hours(self):
+        self.ingest(('2024-03-01 00:00:00', 0), ('2024-03-01 01:00:00', 10), ('2024-03-01 04:00:00', 40),
+                    ('2024-03-01 04:30:00', 41))
+        self.assertEqual(self.hourly(), {'01 00': 10., '01 01': 10., '01 02': 10., '01 03': 10., '01 04': 1.})
+        self.assertEqual(self.daily(), {'01': 41.})
+
+    def test_update_crossing_midnight(self):
+        self.ingest(('2024-03-01 22:00:00', 0), ('2024-03-01 23:00:00', 10))
+        self.assertEqual(self.daily(), {'01': 10.})
+        self.ingest(('2024-03-02 01:00:00', 30))  # spread over the last hour of the previous day too
+        self.assertEqual(self.hourly(), {'01 22': 10., '01 23': 10., '02 00': 10.})
+        self.assertEqual(self.daily(), {'01': 20., '02': 10.})
+
+
+class SwitchingTests(SubDeviceTestCase):
+    def setUp(self):
+        super().setUp()
+        EnergyName.objects.create(name='DigitalOutput1', category=self.subdevice.category)
+
+    def switching(self) -> dict:
+        return {day.day.strftime("%d"): (day.burn_hours, day.switch_on and day.switch_on.strftime("%d %H:%M"),
+                                         day.switch_off and day.switch_off.strftime("%d %H:%M"),
+                                         json.loads(day.intervals))
+                for day in SwitchingDay.objects.all()}
+
+    def ingest(self, *samples):
+        ingest_log_values([self.subdevice], [log_value('DigitalOutput1', event_time, value)
+                                             for event_time, value in samples])
+
+    def test_interval_crossing_midnight(self):
+        self.ingest(('2024-03-01 12:00:00', 'false'), ('2024-03-01 20:00:00', 'true'),
+                    ('2024-03-02 06:00:00', 'false'), ('2024-03-02 12:00:00', 'false'))
+        self.assertEqual(self.switching(), {
+            '01': (4., '01 20:00', None, [['2024-03-01 20:00:00', '2024-03-02 00:00:00']]),
+            '02': (6., None, '02 06:00', [['2024-03-02 00:00:00', '2024-03-02 06:00:00']])})
+
+    def test_series_starting_and_ending_on(self):
+        self.ingest(('2024-03-01 10:00:00', 'true'), ('2024-03-01 14:00:00', 'false'),
+                    ('2024-03-01 18:00:00', 'true'), ('2024-03-01 22:00:00', 'true'))
+        self.assertEqual(self.switching(), {
+            '01': (8., '01 18:00', '01 14:00', [['2024-03-01 10:00:00', '2024-03-01 14:00:00'],
+                                                ['2024-03-01 18:00:00', '2024-03-01 22:00:00']])})
+
+    def test_overlap_asked_again_leaves_the_days_alone(self):
+        samples = (('2024-03-01 12:00:00', 'false'), ('2024-03-01 20:00:00', 'true'), ('2024-03-02 06:00:00', 'false'))
+        self.ingest(*samples)
+        SwitchingDay.objects.update(burn_hours=-1)
+        self.ingest(*samples)
+        self.assertEqual(set(SwitchingDay.objects.values_list('burn_hours', flat=True)), {-1})
+        self.ingest(('2024-03-02 08:00:00', 'true'))  # only the day of the new sample and of the one before
+        self.assertEqual({day: switching[:3] for day, switching in self.switching().items()},
+                         {'01': (-1, '01 20:00', None), '02': (6., '02 08:00', '02 06:00')})
+
+
+class HistoryStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.fleet = FakeFleet(1, history_days=10, end=datetime(2024, 3, 5))
+        self.counter = list(self.fleet.log_values(60000, 'TotalKWHPositive', self.fleet.start, self.fleet.end))
+        self.output = list(self.fleet.log_values(60000, 'DigitalOutput1', self.fleet.start, self.fleet.end))
+
+    def test_append_sets_watermarks(self):
+        store = HistoryStore(self.directory)
+        self.assertEqual(store.append(self.counter + self.output), len(self.counter) + len(self.output))
+        self.assertEqual(store.watermark('TotalKWHPositive'), '2024-03-05 00:00:00')
+        self.assertEqual(store.watermark('DigitalOutput1'), '2024-03-05 00:00:00')
+        self.assertIsNone(store.watermark('Unknown'))
+        reopened = HistoryStore(self.directory, read_only=True)
+        self.assertEqual(len(list(reopened)), len(self.counter) + len(self.output))
+        self.assertEqual([event['eventTime'] for event in reopened.read_range('2024-03-04 23:40:00')],
+                         ['2024-03-04 23:40:00'] * 2 + ['2024-03-04 23:50:00'] * 2 + ['2024-03-05 00:00:00'] * 2)
+
+    def test_late_events_are_merged(self):
+        store = HistoryStore(self.directory)
+        store.append(self.counter[100:])
+        self.assertEqual(store.append(self.counter[:150]), 100)  # only the first 100 were missing
+        events = list(HistoryStore(self.directory, read_only=True))
+        self.assertEqual(events, self.counter)
+
+    def test_overlap_already_stored_leaves_segments_alone(self):
+        store = HistoryStore(self.directory)
+        store.append(self.counter[:-10])
+        version = store.version()
+        manifest = os.path.getmtime(os.path.join(self.directory, 'manifest.json'))
+        self.assertEqual(store.append(self.counter[-50:-10]), 0)  # an update asking the overlap again
+        self.assertEqual(store.version(), version)
+        self.assertEqual(os.path.getmtime(os.path.join(self.directory, 'manifest.json')), manifest)
+        self.assertEqual(store.append(self.counter[-50:]), 10)
+        self.assertEqual(list(HistoryStore(self.directory, read_only=True)), self.counter)
+
+    def test_writers_wait_for_each_other(self):
+        store = HistoryStore(self.directory)
+        appended = []
+        with store.writer() as writer:
+            for event in self.counter[:100]:
+                writer.add(event)
+            other = threading.Thread(target=lambda: appended.append(HistoryStore(self.directory).append(
+                self.counter[50:150])))
+            other.start()
+            other.join(0.5)
+            self.assertTrue(other.is_alive())  # waiting for the lock, without truncating what is being written
+        other.join()
+        self.assertEqual(appended, [50])
+        self.assertEqual(list(HistoryStore(self.directory, read_only=True)), self.counter[:150])
+
+    def test_read_only_store_does_not_create_its_directory(self):
+        directory = os.path.join(self.directory, 'missing')
+        store = HistoryStore(directory, read_only=True)
+        self.assertEqual((list(store), store.watermark('TotalKWHPositive')), ([], None))
+        self.assertFalse(os.path.exists(directory))
+
+    def test_version_only_changes_with_the_range(self):
+        store = HistoryStore(self.directory)
+        store.append(self.counter[:-40])
+        start, end = self.counter[-200]['eventTime'], self.counter[-50]['eventTime']
+        version = store.version(start, end)
+        store.append(self.counter[-30:-20])  # after the range, in the same segment
+        self.assertEqual(store.version(start, end), version)
+        self.assertNotEqual(store.version(start), version)
+        store.append(self.counter[-40:-30])  # late events rewrite the segment
+        self.assertNotEqual(store.version(start, end), version)
+
+    def test_version_changes_with_appends_to_the_range(self):
+        store = HistoryStore(self.directory)
+        store.append(self.counter[:-30])
+        start, end = self.counter[-100]['eventTime'], self.counter[-10]['eventTime']
+        version = store.version(start, end)
+        store.append(self.counter[-30:-25])
+        self.assertNotEqual(store.version(start, end), version)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class RawDataPresentTests(SubDeviceTestCase):
+    def test_malformed_cursor_is_a_bad_request(self):
+        ingest_log_values([self.subdevice], self.events(self.fleet.start, self.fleet.end))
+        url = '/result/60000-TotalKWHPositive-01.03.2024-04.03.2024'
+        self.assertEqual(self.client.get(url, {'after': '2024-03-02 10:00:00'}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'after': 'not a time'}).status_code, 400)
+
+
+class SharedClientTests(SimpleTestCase):
+    def test_clients_share_the_limiter_of_the_server(self):
+        url = 'http://slv.invalid/reports'
+        options = dict(SLV_CLIENT_OPTIONS, cache_options=None)
+        client = get_client(url, ('test', 'test'), **options)
+        self.addCleanup(client.close)
+        self.assertIs(get_client(url, ('test', 'test'), **options), client)
+        other = get_client(url, ('test', 'test'))
+        self.addCleanup(other.close)
+        self.assertIsNot(other, client)
+        self.assertIs(other.limiter, client.limiter)
+        self.assertEqual((client.limiter.bucket.rate, client.limiter.max_limit),
+                         (SLV_LIMITER_OPTIONS['rate'], SLV_LIMITER_OPTIONS['max_limit']))
+        self.assertIsNot(get_client('http://other.invalid/reports', ('test', 'test')).limiter, client.limiter)
+        limiter = AdaptiveLimiter(rate=1.)
+        self.assertIs(SLVClient(url, ('test', 'test'), limiter=limiter).limiter, limiter)
+
+
+class DefaultClientTests(SimpleTestCase):
+    def test_crawls_use_the_response_cache_of_the_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        cache_options = dict(SLV_CLIENT_OPTIONS['cache_options'], directory=directory)
+        with FakeSLVServer(FakeFleet(3)) as server, mock.patch.dict(SLV_CLIENT_OPTIONS, cache_options=cache_options):
+            controllers = [controller['controllerStrId'] for controller in server.fleet.controllers]
+            hits = dict(slv_metrics.cache_hits)
+            for attempt in range(2):
+                devices, errors = crawl_controller_devices(server.url, ('test', 'test'), controllers)
+                tree, tree_errors = crawl_geozones(server.url, ('test', 'test'), ROOT_GEOZONE_ID)
+                self.assertEqual((len(devices), errors, tree_errors), (3, {}, {}))
+            self.assertEqual(slv_metrics.cache_hits['getControllerDevices'] - hits.get('getControllerDevices', 0), 3)
+            self.assertEqual(slv_metrics.cache_hits['getGeozoneChildrenGeozones']
+                             - hits.get('getGeozoneChildrenGeozones', 0), len(tree.geozones))
+
+
+class WriteFileTests(SimpleTestCase):
+    def test_answers_are_written_to_write_file_to(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with FakeSLVServer(FakeFleet(1)) as server:
+            client = SLVClient(server.url, ('test', 'test'))
+            self.addCleanup(client.close)
+            controller = server.fleet.controllers[0]['controllerStrId']
+            write_file_to = os.path.join(directory, 'devices')
+            r, file_name = call_SLV_getControllerDevices(server.url, ('test', 'test'), 'json', controller,
+                                                         write_file_to=write_file_to, client=client)
+            self.assertEqual(read_json_file(write_file_to), r.json())
+            with self.assertRaises(ValueError):
+                call_SLV_getControllerDevices(server.url, ('test', 'test'), 'json', controller,
+                                              write_file_to=write_file_to, client=client, stream=True)
+
+
+class HistorizeTests(SimpleTestCase):
+    def test_compression_of_the_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        fleet = FakeFleet(1, history_days=1, end=datetime(2024, 3, 5))
+        values = list(fleet.log_values(60000, 'TotalKWHPositive', fleet.start, fleet.end))
+        file_path = os.path.join(directory, 'history')
+        historize_log_values(file_path, values[:100])
+        extension = COMPRESSIONS[HISTORY_COMPRESSION][0] if HISTORY_COMPRESSION else ''
+        self.assertEqual(json_file_name(file_path), file_path + '.json' + extension)
+        historize_log_values(file_path, values[50:])
+        self.assertEqual(read_json_file(file_path), values)
+
+
+class CrawlGeozonesTests(SimpleTestCase):
+    def test_command_saves_the_tree(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        output = os.path.join(directory, 'geozones')
+        with FakeSLVServer(FakeFleet(5)) as server, \
+                mock.patch('raw_extractions.management.commands.crawl_geozones.SLV_URL', server.url):
+            call_command('crawl_geozones', root=ROOT_GEOZONE_ID, output=output, stdout=io.StringIO())
+            tree, errors = crawl_geozones(server.url, ('test', 'test'), ROOT_GEOZONE_ID)
+        saved = GeozoneTree.load(output)
+        self.assertEqual(saved.geozones, tree.geozones)
+        self.assertEqual(saved.subtree(ROOT_GEOZONE_ID), tree.subtree(ROOT_GEOZONE_ID))
+        self.assertGreater(len(saved.geozones), 1)
+
+
+class TopologyTests(TestCase):
+    def test_duplicate_slv_names_are_made_unique(self):
+        Device.objects.create(device_str='CBC_FK_0000', device_name='Fake controller 0', device_group='1')
+        controllers = [{'controllerStrId': 'CBC_FK_0000', 'name': 'Street 1', 'geoZoneId': 1},
+                       {'controllerStrId': 'CBC_FK_0001', 'name': 'Street 1', 'geoZoneId': 1},
+                       {'controllerStrId': 'CBC_FK_0002', 'name': 'Fake controller 0', 'geoZoneId': 1}]
+        summary = sync_topology(controllers, {})
+        self.assertEqual(summary['name_conflicts'], {'CBC_FK_0001': 'Street 1 (CBC_FK_0001)',
+                                                     'CBC_FK_0002': 'Fake controller 0 (CBC_FK_0002)'})
+        self.assertEqual(dict(Device.objects.values_list('device_str', 'device_name')), {
+            'CBC_FK_0000': 'Street 1', 'CBC_FK_0001': 'Street 1 (CBC_FK_0001)',
+            'CBC_FK_0002': 'Fake controller 0 (CBC_FK_0002)'})
+        summary = sync_topology(controllers, {})  # the name given up by CBC_FK_0000 is now free
+        self.assertEqual(summary['name_conflicts'], {'CBC_FK_0001': 'Street 1 (CBC_FK_0001)'})
+        self.assertEqual(Device.objects.get(device_str='CBC_FK_0002').device_name, 'Fake controller 0')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class ExportTests(SubDeviceTestCase):
+    def test_csv_and_xlsx_exports(self):
+        ingest_log_values([self.subdevice], self.events(self.fleet.start, self.fleet.end))
+        expected = [['deviceId', 'name', 'eventTime', 'value']] + [
+            [event['deviceId'], event['name'], event['eventTime'], event['value']]
+            for event in self.events(datetime(2024, 3, 8), datetime(2024, 3, 9))]
+        response = self.client.get('/export/60000-TotalKWHPositive-08.03.2024-09.03.2024.csv')
+        lines = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(lines, [[str(value) for value in row] for row in expected])
+        with mock.patch('raw_extractions.exports.XLSX_MAX_ROWS', 100):  # a new sheet every 99 values
+            response = self.client.get('/export/60000-TotalKWHPositive-08.03.2024-09.03.2024.xlsx')
+        self.assertEqual(response['Content-Disposition'].split(';')[0], 'attachment')
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assertEqual(len(workbook.worksheets), -(-(len(expected) - 1) // 99))
+        rows = [[cell.value for cell in row] for worksheet in workbook.worksheets
+                for row in list(worksheet.iter_rows())[1:]]
+        self.assertEqual([list(row[:2]) + [row[2].strftime("%Y-%m-%d %H:%M:%S"), row[3]] for row in rows],
+                         expected[1:])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class MetricsTests(TestCase):
+    def test_only_staff_and_token_read_the_metrics(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with mock.patch('raw_extractions.views.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        user = User.objects.create_user('user', password='password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'slv_request_duration_seconds', response.content)
+
+
+class ChunkedResponse:
+    """stand-in for a streamed requests.Response whose body comes in chunks of chunk_size bytes"""
+    encoding = 'utf-8'
+
+    def __init__(self, body: str, chunk_size: int):
+        self.body = body.encode()
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size: int):
+        return (self.body[i:i + self.chunk_size] for i in range(0, len(self.body), self.chunk_size))
+
+
+class JsonStreamTests(SimpleTestCase):
+    def parse_at_every_chunk_size(self, body: str):
+        expected = json.loads(body)
+        for chunk_size in range(1, len(body) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_json_array(ChunkedResponse(body, chunk_size), chunk_size)), expected)
+
+    def test_numbers_cut_by_chunks(self):
+        self.parse_at_every_chunk_size('[12.5, 1e3, -0.25E-2, 7,123456 ,0]')
+
+    def test_strings_cut_by_chunks(self):
+        self.parse_at_every_chunk_size('["a,b]", "quote \\" inside", "", "\u00e9t\u00e9", "d\u00e9j\u00e0"]')
+
+    def test_nested_values_cut_by_chunks(self):
+        self.parse_at_every_chunk_size('[{"x": [1, {"y": "z"}], "n": null}, [true, false], '
+                                       '{"eventTime": "2024-03-01"}]')
+
+    def test_utf8_cut_by_chunks(self):
+        body = json.dumps(['été', 'déjà vu'], ensure_ascii=False)
+        expected = json.loads(body)
+        for chunk_size in range(1, len(body.encode()) + 1):
+            self.assertEqual(list(iter_json_array(ChunkedResponse(body, chunk_size), chunk_size)), expected)
+
+    def test_invalid_answers(self):
+        for body in ('{"error": 1}', '[1, 2', '[1 2]'):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                list(iter_json_array(ChunkedResponse(body, 4)))
@@ -0,0 +1,116 @@
+"""
+Synchronisation of Device, SubDevice and ControllerType with the controllers and devices known by SLV.
+
+SLV answers are compared in memory with the rows read once from each table, and only the differences are written
+with bulk_create and bulk_update, in one transaction: the number of queries does not depend on the number of
+controllers. Rows missing from SLV are reported but kept, as their history is still needed.
+
+Device names are unique while SLV names are not: a controller whose name is already used by another Device gets its
+controllerStrId appended to it, and is reported.
+"""
+
+from typing import Dict, List
+
+from django.db import transaction
+
+from settings import FILE_PATH_FIELD
+from .models import ControllerType, Device, EnergyName, SubDevice
+
+
+def device_fields(controller: dict) -> dict:
+    """
+    :param controller: a controllerDevice of getAllControllers
+    :return: the Device fields it gives, other than device_str
+    """
+    return {'device_name': controller.get('name') or controller['controllerStrId'],
+            'device_group': str(controller.get('geoZoneId', ''))}
+
+
+def unique_name(name: str, device_str: str) -> str:
+    """name made unique with device_str, within the length of Device.device_name"""
+    suffix = ' ({})'.format(device_str)
+    return name[:Device._meta.get_field('device_name').max_length - len(suffix)] + suffix
+
+
+def sync_devices(controllers: List[dict], summary: dict) -> Dict[str, int]:
+    """
+    Create and update the Devices of the controllers. A name held by another Device, even one renamed by this sync,
+    is never given, so that the rows can be written in any order.
+    :return: {device_str: primary key} of every Device
+    """
+    existing = {device.device_str: device for device in Device.objects.all()}
+    names = {device.device_name: device.device_str for device in existing.values()}  # name -> device_str holding it
+    created = []
+    updated = []
+    conflicts = {}  # device_str -> name given instead of the SLV name
+    for controller in controllers:
+        fields = device_fields(controller)
+        if names.get(fields['device_name'], controller['controllerStrId']) != controller['controllerStrId']:
+            fields['device_name'] = unique_name(fields['device_name'], controller['controllerStrId'])
+            conflicts[controller['controllerStrId']] = fields['device_name']
+        names[fields['device_name']] = controller['controllerStrId']
+        device = existing.pop(controller['controllerStrId'], None)
+        if device is None:
+            created.append(Device(device_str=controller['controllerStrId'], **fields))
+        elif any(getattr(device, field) != value for field, value in fields.items()):
+            for field, value in fields.items():
+                setattr(device, field, value)
+            updated.append(device)
+    Device.objects.bulk_create(created)
+    Device.objects.bulk_update(updated, ['device_name', 'device_group'])
+    summary.update(devices_created=len(created), devices_updated=len(updated), devices_missing=sorted(existing),
+                   name_conflicts=conflicts)
+    return dict(Device.objects.values_list('device_str', 'pk'))
+
+
+def sync_subdevices(devices: Dict[str, List[dict]], device_pks: Dict[str, int], summary: dict):
+    """
+    Create and update the SubDevices and their ControllerTypes. A new SubDevice gets every EnergyName of its category.
+    """
+    categories = {device['categoryStrId'] for controller_devices in devices.values() for device in controller_devices}
+    ControllerType.objects.bulk_create([ControllerType(category=category) for category in categories],
+                                       ignore_conflicts=True)
+    category_pks = dict(ControllerType.objects.values_list('category', 'pk'))
+    existing = {subdevice.device_id: subdevice for subdevice in SubDevice.objects.all()}
+    created = {}
+    updated = []
+    for controller, controller_devices in devices.items():
+        for device in controller_devices:
+            fields = {'device_name_id': device_pks[controller], 'category_id': category_pks[device['categoryStrId']]}
+            subdevice = existing.get(device['id'])
+            if subdevice is None:
+                created[device['id']] = SubDevice(device_id=device['id'],
+                                                  device_value_history=FILE_PATH_FIELD + str(device['id']), **fields)
+            elif any(getattr(subdevice, field) != value for field, value in fields.items()):
+                for field, value in fields.items():
+                    setattr(subdevice, field, value)
+                updated.append(subdevice)
+    SubDevice.objects.bulk_create(created.values())
+    SubDevice.objects.bulk_update(updated, ['device_name', 'category'])
+    energy_names = {}  # energy name primary keys of each category
+    for energy_name_pk, category_pk in EnergyName.objects.values_list('pk', 'category_id'):
+        energy_names.setdefault(category_pk, []).append(energy_name_pk)
+    through = SubDevice.energy_names.through
+    through.objects.bulk_create([
+        through(subdevice_id=subdevice_pk, energyname_id=energy_name_pk)
+        for subdevice_pk, category_pk in SubDevice.objects.filter(device_id__in=list(created)).values_list(
+            'pk', 'category_id')
+        for energy_name_pk in energy_names.get(category_pk, [])])
+    summary.update(subdevices_created=len(created), subdevices_updated=len(updated))
+
+
+def sync_topology(controllers: List[dict], devices: Dict[str, List[dict]]) -> dict:
+    """
+    Bring the tables in line with SLV, in one transaction.
+    :param controllers: the controllerDevice of each controller of getAllControllers
+    :param devices: {controllerStrId: its devices from getControllerDevices}. The SubDevices of controllers missing
+    from it are left as they are.
+    :return: the number of Devices and SubDevices created and updated, the device_str of the Devices missing
+    from SLV and {device_str: name given} of the controllers whose SLV name was already used
+    """
+    summary = {}
+    with transaction.atomic():
+        device_pks = sync_devices(controllers, summary)
+        sync_subdevices({controller: controller_devices for controller, controller_devices in devices.items()
+                         if controller in device_pks}, device_pks, summary)
+    return summary
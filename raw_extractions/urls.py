@@ -21,6 +21,12 @@ urlpatterns = [
     # path('admin/', admin.site.urls),
     path('', views.raw_data_form, name="raw_data_form"),
     path('result/<int:deviceId>-<str:name>-<str:start_date>-<str:end_date>', views.raw_data_present, name='raw_date_present'),
+    path('export/<int:deviceId>-<str:name>-<str:start_date>-<str:end_date>.csv', views.export_csv, name='export_csv'),
+    path('export/all-<str:name>-<str:start_date>-<str:end_date>.csv', views.export_csv, name='export_fleet_csv'),
+    path('export/<int:deviceId>-<str:name>-<str:start_date>-<str:end_date>.xlsx', views.export_xlsx, name='export_xlsx'),
+    path('export/all-<str:name>-<str:start_date>-<str:end_date>.xlsx', views.export_xlsx, name='export_fleet_xlsx'),
+    path('api/<int:deviceId>/<str:name>', views.time_series, name='time_series'),
+    path('metrics', views.metrics, name='metrics'),
     # path('admin/', admin.site.urls),
     # path('raw_extractions/', include('raw_extractions.urls')),
 ]
@@ -1,13 +1,34 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpRequest
+from django.db.models import Max, QuerySet
+from django.http import HttpResponse, HttpRequest, StreamingHttpResponse, FileResponse, Http404, JsonResponse, \
+    HttpResponseBadRequest, HttpResponseForbidden
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_safe
+from .exports import export_rows, iter_csv, write_xlsx
 from .forms import RawDataForm
-import requests
+from .ingestion import parse_event_time
+from .pages import overview_bucket, log_value_page, events_page, log_value_overview, events_overview
+from .models import SubDevice, EnergyName, LogValue
+import hashlib
+import hmac
 import json
 from datetime import datetime
+from typing import Optional
+from api_management.api_calls import call_SLV_getDevicesLogValues
+from api_management.limiter import render_limiters
+from api_management.metrics import slv_metrics, timing
+from api_management.result_cache import ResultCache
+from api_management.slv_client import get_client
+from settings import SLV_URL, logi, SLV_CLIENT_OPTIONS, RAW_DATA_CACHE_SIZE, RAW_DATA_CACHE_TTL, RAW_DATA_PAGE_SIZE, \
+    METRICS_TOKEN
 
 
 # Create your views here.
 
+raw_data_cache = ResultCache(RAW_DATA_CACHE_SIZE)  # results of raw_data_present, by (deviceId, name, dates)
+
 
 def raw_data_form(request):
     """view associated with RawDataForm"""
@@ -27,23 +48,215 @@ def raw_data_form(request):
     return render(request, 'raw_extractions/raw_data_form.html', locals())
 
 
+def fetch_raw_data(deviceId: int, name: str, start_date: str, end_date: str) -> dict:
+    """
+    Call SLV for the log values and keep what data_presentation.html shows, the events being sorted by eventTime
+    for paging
+    """
+    response = call_SLV_getDevicesLogValues(SLV_URL, logi, 'json', deviceId, name, start_date, end_date,
+                                            client=get_client(SLV_URL, logi, **SLV_CLIENT_OPTIONS))
+    with timing('json'):
+        events = response.json() if response.status_code == 200 else []
+    events = sorted(events, key=lambda event: event['eventTime']) if isinstance(events, list) else []
+    return {'raw_data_json': events, 'event_times': [event['eventTime'] for event in events],
+            'raw_data_xml': response.text, 'raw_data_headers': response.headers,
+            'raw_data_status_code': response.status_code}
+
+
+def parse_date(date: str) -> datetime:
+    """the aware datetime of a dd/mm/yyyy date, raises ValueError if date is not in that format"""
+    return timezone.make_aware(datetime.strptime(date, "%d/%m/%Y"), timezone.utc)
+
+
+def local_log_values(deviceId: int, name: str, start_date: str, end_date: str) -> Optional[QuerySet]:
+    """
+    The log values from the LogValue table, read with range scans of its (subdevice, energy_name, event_time) index.
+    :return: the LogValue rows of the range, None if the table does not hold values up to end_date
+    """
+    try:
+        start, end = parse_date(start_date), parse_date(end_date)
+    except ValueError:
+        return None
+    subdevice_pk = SubDevice.objects.filter(device_id=deviceId).values_list('pk', flat=True).first()
+    energy_name_pk = EnergyName.objects.filter(name=name).values_list('pk', flat=True).first()
+    if subdevice_pk is None or energy_name_pk is None:
+        return None
+    log_values = LogValue.objects.filter(subdevice_id=subdevice_pk, energy_name_id=energy_name_pk)
+    latest = log_values.aggregate(latest=Max('event_time'))['latest']
+    if latest is None or latest < end:
+        return None
+    return log_values.filter(event_time__range=(start, end))
+
+
+def raw_data_ttl(end_date: str) -> Optional[float]:
+    """seconds during which a result stays valid: forever if the range is fully past, as it will not change"""
+    try:
+        end = parse_date(end_date)
+    except ValueError:
+        return RAW_DATA_CACHE_TTL.total_seconds()
+    return None if end <= timezone.now() else RAW_DATA_CACHE_TTL.total_seconds()
+
+
 def raw_data_present(request: HttpRequest, deviceId: int, name: str, start_date: str,
                      end_date: str) -> HttpResponse:
-    """Presenting API result"""
-    SLV_URL = "http://citybox2.axione.fr/reports/"
-    start_date.replace(".", "/")
-    end_date.replace(".", "/")
-    api_method = 'getDevicesLogValues'  # function which gets called on SLV server
-    api_part = '/api/logging/'  # where the function is on SLV server
-    response = requests.post(SLV_URL + api_part + api_method,
-                             data={"ser": "json", "from": start_date, "to": end_date, "deviceId": deviceId,
-                                   "name": name},
-                             auth=("d.mocellin", "Nevers1.1"))
-    raw_data_json = response.json()
-    raw_data_headers = response.headers
-    raw_data_xml = response.text
-    raw_data_status_code = response.status_code
-    print(response.text)
+    """
+    Presenting API result, RAW_DATA_PAGE_SIZE events at a time. The query parameter after is the eventTime of the
+    last event of the previous page, overview=1 adds the min/max/avg of each bucket of the range.
+    Ranges already ingested are read from LogValue. Otherwise identical requests share one SLV call and its result is
+    kept in raw_data_cache.
+    """
+    start_date = start_date.replace(".", "/")
+    end_date = end_date.replace(".", "/")
+    after = request.GET.get('after') or None
+    if after is not None:
+        try:
+            parse_event_time(after)
+        except ValueError:
+            return HttpResponseBadRequest("after must be an eventTime as yyyy-mm-dd hh:mm:ss")
+    with_overview = request.GET.get('overview') == '1'
+    try:
+        kind = overview_bucket(parse_date(start_date), parse_date(end_date))
+    except ValueError:
+        kind = 'day'
+    log_values = local_log_values(deviceId, name, start_date, end_date)
+    if log_values is not None:
+        page, next_cursor = log_value_page(log_values, deviceId, name, after, RAW_DATA_PAGE_SIZE)
+        overview = log_value_overview(log_values, kind) if with_overview else None
+        raw_data = {'raw_data_xml': '', 'raw_data_headers': {}, 'raw_data_status_code': 200}
+    else:
+        raw_data = raw_data_cache.get_or_compute((deviceId, name, start_date, end_date),
+                                                 lambda: fetch_raw_data(deviceId, name, start_date, end_date),
+                                                 ttl=raw_data_ttl(end_date),
+                                                 cache_if=lambda result: result['raw_data_status_code'] == 200)
+        page, next_cursor = events_page(raw_data['raw_data_json'], raw_data['event_times'], after,
+                                        RAW_DATA_PAGE_SIZE)
+        overview = events_overview(raw_data['raw_data_json'], kind) if with_overview else None
     return render(request, 'raw_extractions/data_presentation.html',
-                  {'raw_data_json': raw_data_json, 'raw_data_xml': raw_data_xml, 'raw_data_headers': raw_data_headers,
-                   'raw_data_status_code': raw_data_status_code})
+                  dict(raw_data, raw_data_json=page, next_cursor=next_cursor, after=after, overview=overview,
+                       overview_bucket=kind, deviceId=deviceId, name=name, start_date=start_date.replace("/", "."),
+                       end_date=end_date.replace("/", ".")))
+
+
+def export_range(deviceId: Optional[int], name: str, start_date: str, end_date: str) -> tuple:
+    """
+    :param deviceId: the SubDevice exported, None for every SubDevice having the energy name
+    :return: the export_rows generator of the range and the base name of the exported file
+    """
+    try:
+        start = parse_date(start_date.replace(".", "/"))
+        end = parse_date(end_date.replace(".", "/"))
+    except ValueError:
+        raise Http404("dates must be given as dd.mm.yyyy")
+    subdevices = SubDevice.objects.filter(energy_names__name=name).order_by('device_id')
+    if deviceId is not None:
+        subdevices = subdevices.filter(device_id=deviceId)
+    file_name = "{}-{}-{}-{}".format(deviceId or 'all', name, start_date, end_date)
+    return export_rows(subdevices, name, start, end), file_name
+
+
+def export_csv(request: HttpRequest, name: str, start_date: str, end_date: str,
+               deviceId: int = None) -> StreamingHttpResponse:
+    """Log values of the range as CSV, streamed line by line from the history stores"""
+    rows, file_name = export_range(deviceId, name, start_date, end_date)
+    response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(file_name)
+    return response
+
+
+def export_xlsx(request: HttpRequest, name: str, start_date: str, end_date: str,
+                deviceId: int = None) -> FileResponse:
+    """
+    Log values of the range as an Excel workbook, written row by row to a temporary file then sent: memory use is
+    bounded, but nothing is sent before the whole workbook is written
+    """
+    rows, file_name = export_range(deviceId, name, start_date, end_date)
+    return FileResponse(write_xlsx(rows), as_attachment=True, filename=file_name + '.xlsx',
+                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+API_RESOLUTIONS = ('raw', 'hour', 'day', 'month')
+
+
+def parse_api_time(value: str) -> datetime:
+    """the aware datetime of a yyyy-mm-dd date or yyyy-mm-dd hh:mm:ss time, UTC unless it has an offset"""
+    parsed = parse_datetime(value) or parse_datetime(value + ' 00:00:00')
+    if parsed is None:
+        raise ValueError("{} is not a yyyy-mm-dd date or a yyyy-mm-dd hh:mm:ss time".format(value))
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, timezone.utc)
+
+
+def time_series_query(request: HttpRequest) -> tuple:
+    """
+    :return: the from and to times and the resolution asked, raises ValueError if one is missing or wrong
+    """
+    try:
+        start, end = parse_api_time(request.GET['from']), parse_api_time(request.GET['to'])
+    except KeyError:
+        raise ValueError("from and to are required")
+    resolution = request.GET.get('resolution', 'raw')
+    if resolution not in API_RESOLUTIONS:
+        raise ValueError("resolution must be one of {}".format(', '.join(API_RESOLUTIONS)))
+    return start, end, resolution
+
+
+def time_series_etag(request: HttpRequest, deviceId: int, name: str) -> Optional[str]:
+    """
+    Strong ETag of a time_series answer, from the version of the history store over the range: it only changes when
+    values are added to the range. None when the query is wrong, the view answers the error.
+    """
+    try:
+        start, end, resolution = time_series_query(request)
+    except ValueError:
+        return None
+    subdevice = SubDevice.objects.filter(device_id=deviceId).first()
+    if subdevice is None:
+        return None
+    version = subdevice.history_store(read_only=True).version(start.strftime("%Y-%m-%d %H:%M:%S"),
+                                                              end.strftime("%Y-%m-%d %H:%M:%S"))
+    gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')  # each encoding is a different representation
+    key = [deviceId, name, start.isoformat(), end.isoformat(), resolution, gzipped, version]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+@require_safe
+@condition(etag_func=time_series_etag)
+@gzip_page
+def time_series(request: HttpRequest, deviceId: int, name: str) -> JsonResponse:
+    """
+    Log values of a SubDevice from the LogValue table, as JSON.
+    Query parameters: from and to (yyyy-mm-dd or yyyy-mm-dd hh:mm:ss, UTC), resolution: raw (default) for
+    [eventTime, value] pairs, or hour, day or month for the min, max, average and count of each bucket.
+    Answers carry an ETag, a request with a matching If-None-Match gets a 304 without the data.
+    """
+    try:
+        start, end, resolution = time_series_query(request)
+    except ValueError as error_caught:
+        return JsonResponse({'error': str(error_caught)}, status=400)
+    subdevice_pk = SubDevice.objects.filter(device_id=deviceId).values_list('pk', flat=True).first()
+    energy_name_pk = EnergyName.objects.filter(name=name).values_list('pk', flat=True).first()
+    if subdevice_pk is None or energy_name_pk is None:
+        return JsonResponse({'error': "unknown device {} or energy name {}".format(deviceId, name)}, status=404)
+    log_values = LogValue.objects.filter(subdevice_id=subdevice_pk, energy_name_id=energy_name_pk,
+                                         event_time__range=(start, end))
+    if resolution == 'raw':
+        data = [[event_time.strftime("%Y-%m-%d %H:%M:%S"), value]
+                for event_time, value in log_values.order_by('event_time').values_list('event_time', 'value')]
+    else:
+        data = log_value_overview(log_values, resolution)
+    return JsonResponse({'deviceId': deviceId, 'name': name, 'from': start.strftime("%Y-%m-%d %H:%M:%S"),
+                         'to': end.strftime("%Y-%m-%d %H:%M:%S"), 'resolution': resolution, 'data': data})
+
+
+@require_safe
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    metrics of the SLV calls and limiters of this process, in the Prometheus text format. Only for staff users and
+    for requests with the METRICS_TOKEN as bearer token, e.g. from Prometheus.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token_given = bool(METRICS_TOKEN) and authorization.startswith('Bearer ') and hmac.compare_digest(
+        authorization[len('Bearer '):].encode(), METRICS_TOKEN.encode())
+    if not (token_given or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(slv_metrics.render() + render_limiters(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,53 @@
+from datetime import timedelta
+
 FILE_PATH_FIELD = 'log_values\\' #where all log values are stored
 
 SLV_URL = "http://citybox2.axione.fr/reports/"  # URL of SLV server
-logi = ('d.mocellin', 'Nevers1.1')  # the login necessary to get to the website
\ No newline at end of file
+logi = ('d.mocellin', 'Nevers1.1')  # the login necessary to get to the website
+SLV_CLIENT_OPTIONS = {'pool_size': 10,  # connections kept alive to SLV server
+                      'timeout': (10, 120),  # (connect, read) timeout in seconds
+                      'retries': 3,  # retries on 5xx answers and connection resets
+                      'backoff_factor': 0.5,  # sleep 0.5, 1, 2... seconds between retries
+                      'cache_options': {'directory': 'slv_cache',  # where slow-changing SLV answers are cached
+                                        'max_bytes': 50 * 1024 * 1024,
+                                        'ttl': {'getAllControllers': timedelta(days=1),
+                                                'getControllerDevices': timedelta(days=1),
+                                                'searchGeozones': timedelta(days=7),
+                                                'getGeozoneChildrenGeozones': timedelta(days=7),
+                                                'getDeviceValueDescriptors': timedelta(days=7)}}}
+SLV_LIMITER_OPTIONS = {'rate': 20.,  # requests per second to SLV server, all clients of the process together
+                       'initial_limit': 4.,  # calls in flight at first, then adapted to SLV
+                       'max_limit': 32.}
+
+LOG_VALUES_BACKFILL = timedelta(days=15)  # window asked to SLV for an energy name never fetched before
+LOG_VALUES_OVERLAP = timedelta(hours=1)  # asked again before the last value stored, for values SLV stores late
+LOG_VALUES_BATCH_SIZE = 50  # SubDevices updated by one getDevicesLogValues call
+LOG_VALUES_BACKFILL_WORKERS = 4  # chunks of a backfill fetched at once
+
+RAW_DATA_CACHE_SIZE = 128  # raw_data_present results kept in memory
+RAW_DATA_CACHE_TTL = timedelta(minutes=5)  # validity of a result whose range is not fully past
+RAW_DATA_PAGE_SIZE = 500  # events shown per page of raw_data_present
+RAW_DATA_OVERVIEW_BUCKETS = 200  # most buckets of the raw_data_present overview
+LOG_VALUES_BULK_SIZE = 5000  # LogValue rows buffered per bulk_create, inserted in batches the database accepts
+ROLLUP_ENERGY_NAME = 'TotalKWHPositive'  # counter index from which hourly and daily kWh are computed
+SWITCHING_ENERGY_NAME = 'DigitalOutput1'  # output state from which daily switch-on/off times are computed
+XLSX_MAX_ROWS = 1048576  # rows of an Excel worksheet, header included
+ELECTRIC_COUNTER_CATEGORY = 'electricalCounter'  # ControllerType of the SubDevices offered in RawDataForm
+FORM_CHOICES_TTL = timedelta(minutes=10)  # how long RawDataForm choices read from the database are kept
+
+SERVER_TIMING = False  # ServerTimingMiddleware adds a Server-Timing header to every answer and logs slow requests
+SLOW_REQUEST_SECONDS = 2.  # requests at least this long are logged by ServerTimingMiddleware
+SLOW_REQUEST_LOG_RATE = 0.1  # share of the slow requests which are logged
+PROFILE_HEADER = 'X-Profile'  # request header with which a staff user gets a cProfile report instead of the page
+PROFILE_STATS_LINES = 60  # functions listed in a cProfile report
+METRICS_TOKEN = None  # bearer token with which Prometheus can read /metrics, which staff users read without it
+
+HISTORY_COMPRESSION = 'gzip'  # 'gzip', 'lzma' or None: compression of the past months of the SubDevice histories
+
+GEOZONE_ROOT_ID = None  # ID of the geozone from which crawl_geozones walks the tree, e.g. found with searchGeozones
+GEOZONE_TREE_FILE = 'geozones'  # where crawl_geozones saves the tree, without its '.json' extension
+
+INGEST_INTERVAL = timedelta(minutes=15)  # run_ingest updates each SubDevice this often, spread over the interval
+INGEST_WORKERS = 2  # SubDevice updates run at once by run_ingest
+INGEST_RETRY_DELAY = timedelta(minutes=1)  # wait after a first failed update, doubled at each further failure
+INGEST_MAX_RETRY_DELAY = timedelta(hours=2)  # longest wait after failed updates